@@ -0,0 +1,333 @@
+"""
+Benchmark of the Housekeeping date extraction.
+
+Generates a synthetic corpus (JPEGs with and without EXIF, PNGs, small
+MP4/MOV files and corrupt files) and measures files/sec, bytes read per file
+and p50/p99 per-file latency for the image and video extractors and for the
+full scan, in each execution mode. Results are saved as JSON, and an earlier
+result file can be passed with --compare to spot regressions.
+
+Bytes read are the rchar counters in /proc/<pid>/io of the whole process
+tree - this process, the worker processes and the child processes running
+hachoir - less the benchmark's own reads of /proc, so they are only reported
+on Linux. Latency is measured around the extraction of each file, in the
+process that extracts it. Files found in the cache aren't extracted, so a
+warm cache scan has no latency figures.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from PIL import Image
+
+import main
+from exif_reader import TAG_DATE_TIME_ORIGINAL
+from scan_cache import ScanCache
+from video_reader import MP4_EPOCH
+
+TAG_EXIF_IFD_POINTER = 0x8769
+
+
+# Bytes this process has read from /proc to measure the others - they count as reads too
+_proc_bytes_read = 0
+
+
+def _read_proc(path):
+    global _proc_bytes_read
+    with open(path, 'rb') as f:
+        data = f.read()
+    _proc_bytes_read += len(data)
+    return data
+
+
+def _rchar(pid):
+    for line in _read_proc(f'/proc/{pid}/io').splitlines():
+        if line.startswith(b'rchar:'):
+            return int(line.split()[1])
+    raise ValueError(f'No rchar in /proc/{pid}/io')
+
+
+def _read_bytes_counter():
+    """
+    :return: Bytes read by this process and its descendants so far, or None without /proc.
+             Children that have exited (and were waited for) are in their parent's count.
+    """
+    own_reads = _proc_bytes_read
+    try:
+        total = _rchar('self') - own_reads
+    except (OSError, ValueError):
+        return None
+    pending = [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        try:
+            if pid != os.getpid():
+                total += _rchar(pid)
+            for thread_id in os.listdir(f'/proc/{pid}/task'):
+                pending.extend(int(child) for child in _read_proc(f'/proc/{pid}/task/{thread_id}/children').split())
+        except (OSError, ValueError):
+            # Exited in the meantime - its reads went to its parent
+            continue
+    return total
+
+
+def _write_mp4(path, date_taken, payload_size):
+    seconds = int((date_taken - MP4_EPOCH).total_seconds())
+    mvhd_payload = struct.pack('>4xII', seconds, seconds) + bytes(88)
+    mvhd = struct.pack('>I4s', 8 + len(mvhd_payload), b'mvhd') + mvhd_payload
+    moov = struct.pack('>I4s', 8 + len(mvhd), b'moov') + mvhd
+    brand = b'qt  ' if path.endswith('.mov') else b'isom'
+    ftyp = struct.pack('>I4s4sI', 16, b'ftyp', brand, 0)
+    mdat = struct.pack('>I4s', 8 + payload_size, b'mdat') + os.urandom(payload_size)
+    # Like many cameras, put moov after the media data
+    with open(path, 'wb') as f:
+        f.write(ftyp + mdat + moov)
+
+
+def generate_corpus(folder, count):
+    """
+    Write count files of every kind into folder.
+
+    :return: Dictionary with the number of files per kind
+    """
+    random.seed(42)
+    kinds = {}
+
+    def add(kind):
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    for i in range(count):
+        sub_folder = os.path.join(folder, f'{i % 16:02d}')
+        os.makedirs(sub_folder, exist_ok=True)
+        date_taken = datetime(2015 + i % 10, 1 + i % 12, 1 + i % 28, 12, i % 60)
+        image = Image.effect_noise((640, 480), 64).convert('RGB')
+
+        exif = Image.Exif()
+        exif.get_ifd(TAG_EXIF_IFD_POINTER)[TAG_DATE_TIME_ORIGINAL] = f'{date_taken:%Y:%m:%d %H:%M:%S}'
+        path = os.path.join(sub_folder, f'exif_{i}.jpg')
+        image.save(path, exif=exif.tobytes())
+        add('jpeg_exif')
+
+        path = os.path.join(sub_folder, f'plain_{i}.jpg')
+        image.save(path)
+        add('jpeg_plain')
+
+        path = os.path.join(sub_folder, f'image_{i}.png')
+        image.save(path, exif=exif.tobytes())
+        add('png')
+
+        for ext in ('.mp4', '.mov'):
+            path = os.path.join(sub_folder, f'video_{i}{ext}')
+            _write_mp4(path, date_taken, random.randint(256, 1024) * 1024)
+            add(ext[1:])
+
+        for ext in ('.jpg', '.mp4'):
+            path = os.path.join(sub_folder, f'corrupt_{i}{ext}')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(random.randint(1, 64) * 1024))
+            add('corrupt')
+
+    return kinds
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _result(benchmark, mode, latencies, seconds, bytes_read, files):
+    return {
+        'benchmark': benchmark,
+        'mode': mode,
+        'files': files,
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(files / seconds, 1) if seconds else None,
+        'bytes_per_file': round(bytes_read / files) if bytes_read is not None and files else None,
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+_EXTRACTORS = {
+    'image': main.get_image_date_taken,
+    'video': main.get_video_date_taken,
+}
+
+
+def _timed_extract(extractor_name, path):
+    # Runs wherever the extraction runs
+    start = time.perf_counter()
+    _EXTRACTORS[extractor_name](path)
+    return time.perf_counter() - start
+
+
+def _timed_extract_chunk(extractor_name, paths):
+    return [_timed_extract(extractor_name, path) for path in paths]
+
+
+def benchmark_extractor(extractor_name, paths, mode, workers):
+    bytes_before = _read_bytes_counter()
+    start = time.perf_counter()
+
+    if mode == 'serial':
+        timings = [_timed_extract(extractor_name, path) for path in paths]
+    elif mode == 'threads':
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            timings = list(executor.map(lambda path: _timed_extract(extractor_name, path), paths))
+    else:
+        chunks = [paths[i:i + 32] for i in range(0, len(paths), 32)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            timings = [timing for chunk_timings in executor.map(
+                _timed_extract_chunk, [extractor_name] * len(chunks), chunks) for timing in chunk_timings]
+
+    seconds = time.perf_counter() - start
+    # The worker processes have been waited for, so their reads are in the count
+    bytes_after = _read_bytes_counter()
+    bytes_read = bytes_after - bytes_before if bytes_before is not None else None
+    return _result(extractor_name, mode, timings, seconds, bytes_read, len(paths))
+
+
+class _TimedRecords(list):
+    # The records of a chunk, and the seconds each file took - pickled back from the worker together
+    latencies = ()
+
+
+def _timed_dates_for_chunk(paths, video_timeout=main.HACHOIR_TIMEOUT):
+    records = _TimedRecords()
+    records.latencies = []
+    for path in paths:
+        start = time.perf_counter()
+        records.append(main.extract_date(path, video_timeout))
+        records.latencies.append(time.perf_counter() - start)
+    return records
+
+
+@contextmanager
+def _scan_latencies(latencies):
+    # Let the scan extract its chunks with _timed_dates_for_chunk, and collect
+    # the latencies as the chunks are merged
+    dates_for_chunk, merge_chunk = main._dates_for_chunk, main._merge_chunk
+
+    def merge_timed_chunk(results, misses, miss_results, cache):
+        latencies.extend(miss_results.latencies if isinstance(miss_results, _TimedRecords) else ())
+        return merge_chunk(results, misses, miss_results, cache)
+
+    main._dates_for_chunk, main._merge_chunk = _timed_dates_for_chunk, merge_timed_chunk
+    try:
+        yield
+    finally:
+        main._dates_for_chunk, main._merge_chunk = dates_for_chunk, merge_chunk
+
+
+def benchmark_scan(folder, mode, workers, cache_path=None):
+    cache = ScanCache(cache_path) if cache_path else None
+    bytes_before = _read_bytes_counter()
+    latencies = []
+    files = 0
+    try:
+        start = time.perf_counter()
+        with _scan_latencies(latencies):
+            for _ in main.scan_dates_taken(folder, workers=1 if mode.startswith('serial') else workers,
+                                           cache=cache):
+                files += 1
+        seconds = time.perf_counter() - start
+    finally:
+        if cache is not None:
+            cache.close()
+    bytes_after = _read_bytes_counter()
+    bytes_read = bytes_after - bytes_before if bytes_before is not None else None
+    return _result('scan', mode, latencies, seconds, bytes_read, files)
+
+
+def run_benchmarks(folder, workers):
+    paths = [entry.path for entry in main.iter_files(folder)]
+    image_paths = [path for path in paths if main.media_kind(path) == main.KIND_IMAGE]
+    video_paths = [path for path in paths if main.media_kind(path) == main.KIND_VIDEO]
+
+    # Extract every file once first - this loads the plugins PIL and hachoir import on first use,
+    # and puts the files in the OS cache, so the first mode measured isn't charged for either
+    for extractor_name, extractor_paths in (('image', image_paths), ('video', video_paths)):
+        for path in extractor_paths:
+            _EXTRACTORS[extractor_name](path)
+
+    results = []
+    for extractor_name, extractor_paths in (('image', image_paths), ('video', video_paths)):
+        for mode in ('serial', 'threads', 'processes'):
+            results.append(benchmark_extractor(extractor_name, extractor_paths, mode, workers))
+            print(json.dumps(results[-1]), file=sys.stderr)
+
+    results.append(benchmark_scan(folder, 'serial', workers))
+    results.append(benchmark_scan(folder, 'processes', workers))
+    cache_folder = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(cache_folder, 'cache.db')
+        results.append(benchmark_scan(folder, 'serial_cache_cold', workers, cache_path))
+        results.append(benchmark_scan(folder, 'serial_cache_warm', workers, cache_path))
+    finally:
+        shutil.rmtree(cache_folder)
+    for result in results[-4:]:
+        print(json.dumps(result), file=sys.stderr)
+    return results
+
+
+def compare(old_results, new_results):
+    old = {(r['benchmark'], r['mode']): r for r in old_results}
+    for result in new_results:
+        previous = old.get((result['benchmark'], result['mode']))
+        if previous is None or not previous['files_per_sec'] or not result['files_per_sec']:
+            continue
+        change = result['files_per_sec'] / previous['files_per_sec'] - 1
+        print(f"{result['benchmark']:>6} {result['mode']:<18} "
+              f"{previous['files_per_sec']:>10} -> {result['files_per_sec']:>10} files/sec ({change:+.1%})")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the Housekeeping date extraction')
+    arg_parser.add_argument('--count', type=int, default=100,
+                            help='number of files of every kind in the synthetic corpus')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    arg_parser.add_argument('--corpus', metavar='FOLDER',
+                            help='use (and keep) the corpus in FOLDER - it is generated if FOLDER does not exist')
+    arg_parser.add_argument('--output', default='benchmark_results.json')
+    arg_parser.add_argument('--compare', metavar='FILE', help='earlier result file to compare with')
+    args = arg_parser.parse_args()
+
+    corpus = args.corpus or tempfile.mkdtemp(prefix='housekeeping_corpus_')
+    try:
+        corpus_kinds = None
+        if not args.corpus or not os.path.exists(args.corpus):
+            corpus_kinds = generate_corpus(corpus, args.count)
+        results = run_benchmarks(corpus, args.workers)
+    finally:
+        if not args.corpus:
+            shutil.rmtree(corpus)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'corpus': corpus_kinds,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f)['results'], results)
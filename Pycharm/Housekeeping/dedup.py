@@ -0,0 +1,141 @@
+"""
+Find duplicate files by content.
+
+Files are grouped by size first - a file with a unique size can't have a
+duplicate and is never opened. Within a size group only the first and last
+few KB are hashed, and only files whose partial hashes collide are hashed in
+full.
+"""
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Bytes hashed from the start and from the end of a file for the partial hash
+PARTIAL_SIZE = 8 * 1024
+
+_READ_SIZE = 1024 * 1024
+
+PARTIAL = 'partial'
+FULL = 'full'
+
+
+def _new_hasher():
+    # Prefix the digests with the algorithm, so cached hashes from another
+    # algorithm can be told apart and hashed again
+    if blake3 is not None:
+        return 'blake3', blake3.blake3()
+    if xxhash is not None:
+        return 'xxh3', xxhash.xxh3_128()
+    return 'blake2b', hashlib.blake2b()
+
+
+def partial_hash(path, size):
+    name, hasher = _new_hasher()
+    with open(path, 'rb') as f:
+        hasher.update(f.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE:
+            f.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            hasher.update(f.read(PARTIAL_SIZE))
+    return f'{name}:{hasher.hexdigest()}'
+
+
+def full_hash(path):
+    name, hasher = _new_hasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_SIZE), b''):
+            hasher.update(block)
+    return f'{name}:{hasher.hexdigest()}'
+
+
+def _hash_entries(executor, entries, sizes, kind, cache):
+    # Returns {entry: hash}. Cache lookups and writes stay in this thread,
+    # only the hashing itself runs in the pool.
+    algorithm, _ = _new_hasher()
+    hashes = {}
+    to_hash = []
+    for entry in entries:
+        cached = cache.lookup_hash(entry, kind) if cache is not None else None
+        if cached is None or not cached.startswith(algorithm + ':'):
+            # Hashed with another algorithm (blake3 or xxhash was installed or
+            # removed since) - it would never match the ones hashed now
+            to_hash.append(entry)
+        else:
+            hashes[entry] = cached
+
+    def hash_entry(entry):
+        try:
+            if kind == PARTIAL:
+                return partial_hash(entry.path, sizes[entry])
+            return full_hash(entry.path)
+        except OSError:
+            # Vanished or unreadable - it can't be reported as a duplicate
+            return None
+
+    for entry, value in zip(to_hash, executor.map(hash_entry, to_hash)):
+        if value is None:
+            continue
+        hashes[entry] = value
+        if cache is not None:
+            cache.store_hash(entry, kind, value)
+    return hashes
+
+
+def _group_by(entries, key):
+    groups = {}
+    for entry in entries:
+        groups.setdefault(key(entry), []).append(entry)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(entries, workers=8, cache=None):
+    """
+    Find files with identical content.
+
+    :param entries: os.DirEntry objects of the files to compare, e.g. from iter_files
+    :param workers: Number of threads hashing files
+    :param cache: Optional ScanCache that hashes are looked up in and stored in
+    :return: List of (size, hash, paths) for every group of identical files
+    """
+    sizes = {}
+    for entry in entries:
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            # Vanished since it was listed
+            continue
+        if size > 0:
+            sizes[entry] = size
+    size_groups = _group_by(sizes, lambda entry: sizes[entry])
+    candidates = [entry for group in size_groups for entry in group]
+
+    duplicates = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        partial_hashes = _hash_entries(executor, candidates, sizes, PARTIAL, cache)
+        partial_groups = _group_by(partial_hashes, lambda entry: (sizes[entry], partial_hashes[entry]))
+
+        # For small files the partial hash already covered every byte
+        needs_full_hash = []
+        for group in partial_groups:
+            size = sizes[group[0]]
+            if size <= 2 * PARTIAL_SIZE:
+                duplicates.append((size, partial_hashes[group[0]], sorted(e.path for e in group)))
+            else:
+                needs_full_hash.extend(group)
+
+        full_hashes = _hash_entries(executor, needs_full_hash, sizes, FULL, cache)
+        for group in _group_by(full_hashes, lambda entry: (sizes[entry], full_hashes[entry])):
+            duplicates.append((sizes[group[0]], full_hashes[group[0]], sorted(e.path for e in group)))
+
+    if cache is not None:
+        cache.flush()
+    return duplicates
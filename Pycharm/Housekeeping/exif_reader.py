@@ -0,0 +1,155 @@
+"""
+Minimal EXIF reader that only looks for DateTimeOriginal (tag 0x9003).
+
+Instead of letting PIL parse the whole image container, the JPEG segments are
+skipped one by one until the APP1 Exif segment is found, and from the TIFF
+structure inside it only IFD0 and the Exif sub-IFD are read. For a typical
+photo this means reading a few KB of the file.
+"""
+
+import struct
+
+TAG_EXIF_IFD_POINTER = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+
+TYPE_ASCII = 2
+
+JPEG_SOI = b'\xff\xd8'
+TIFF_LE = b'II*\x00'
+TIFF_BE = b'MM\x00*'
+
+# Markers that are not followed by a length field
+_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+# Start of scan - after this comes compressed image data, never any metadata
+_MARKER_SOS = 0xDA
+_MARKER_APP1 = 0xE1
+
+# Safety limit - a real IFD has far fewer entries than this
+_MAX_IFD_ENTRIES = 1024
+
+
+class ExifFormatError(ValueError):
+    pass
+
+
+def read_date_time_original(path):
+    """
+    Read the raw DateTimeOriginal value of a JPEG or TIFF file.
+
+    :return: The value as a string (e.g. '2023:07:14 12:34:56'), or None if the file has no such tag
+    :raises ExifFormatError: If the file is not a JPEG/TIFF file or is malformed
+    """
+    with open(path, 'rb') as f:
+        header = f.read(4)
+        if header[:2] == JPEG_SOI:
+            f.seek(2)
+            tiff = _read_jpeg_exif_segment(f)
+            if tiff is None:
+                return None
+            return _read_tiff_date(_BufferReader(tiff))
+        if header in (TIFF_LE, TIFF_BE):
+            return _read_tiff_date(_FileReader(f))
+    raise ExifFormatError('Not a JPEG or TIFF file')
+
+
+def _read_jpeg_exif_segment(f):
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ExifFormatError('Invalid JPEG marker')
+        code = marker[1]
+        # Fill bytes may precede a marker
+        while code == 0xFF:
+            byte = f.read(1)
+            if not byte:
+                raise ExifFormatError('Truncated JPEG file')
+            code = byte[0]
+        if code in _STANDALONE_MARKERS:
+            continue
+        if code == _MARKER_SOS:
+            return None
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise ExifFormatError('Truncated JPEG file')
+        length = struct.unpack('>H', length_bytes)[0] - 2
+        if length < 0:
+            raise ExifFormatError('Invalid JPEG segment length')
+
+        if code == _MARKER_APP1:
+            segment = f.read(length)
+            if len(segment) < length:
+                raise ExifFormatError('Truncated JPEG file')
+            # APP1 is also used for XMP, so check the identifier
+            if segment[:6] == b'Exif\x00\x00':
+                return segment[6:]
+        else:
+            f.seek(length, 1)
+
+
+class _BufferReader:
+    def __init__(self, data):
+        self.data = data
+
+    def read_at(self, offset, size):
+        if offset < 0 or offset + size > len(self.data):
+            raise ExifFormatError('Offset outside of the Exif segment')
+        return self.data[offset:offset + size]
+
+
+class _FileReader:
+    def __init__(self, f):
+        self.f = f
+
+    def read_at(self, offset, size):
+        self.f.seek(offset)
+        data = self.f.read(size)
+        if len(data) < size:
+            raise ExifFormatError('Offset outside of the TIFF file')
+        return data
+
+
+def _read_tiff_date(reader):
+    header = reader.read_at(0, 8)
+    if header[:4] == TIFF_LE:
+        endian = '<'
+    elif header[:4] == TIFF_BE:
+        endian = '>'
+    else:
+        raise ExifFormatError('Invalid TIFF header')
+    ifd0_offset = struct.unpack(endian + 'I', header[4:8])[0]
+
+    exif_ifd_entry = _find_ifd_entry(reader, endian, ifd0_offset, TAG_EXIF_IFD_POINTER)
+    if exif_ifd_entry is None:
+        return None
+    _, _, _, value = exif_ifd_entry
+    exif_ifd_offset = struct.unpack(endian + 'I', value)[0]
+
+    date_entry = _find_ifd_entry(reader, endian, exif_ifd_offset, TAG_DATE_TIME_ORIGINAL)
+    if date_entry is None:
+        return None
+    _, field_type, count, value = date_entry
+    if field_type != TYPE_ASCII:
+        raise ExifFormatError('DateTimeOriginal is not an ASCII value')
+
+    # Values of up to 4 bytes are stored inline, otherwise the field holds an offset
+    if count <= 4:
+        raw = value[:count]
+    else:
+        raw = reader.read_at(struct.unpack(endian + 'I', value)[0], count)
+    return raw.split(b'\x00', 1)[0].decode('ascii', errors='replace').strip() or None
+
+
+def _find_ifd_entry(reader, endian, offset, wanted_tag):
+    entry_count = struct.unpack(endian + 'H', reader.read_at(offset, 2))[0]
+    if entry_count > _MAX_IFD_ENTRIES:
+        raise ExifFormatError('Implausible number of IFD entries')
+    entries = reader.read_at(offset + 2, entry_count * 12)
+
+    # The spec says entries are sorted by tag, but not every camera obeys,
+    # so look at all of them
+    for i in range(0, len(entries), 12):
+        tag, field_type, count = struct.unpack(endian + 'HHI', entries[i:i + 8])
+        if tag == wanted_tag:
+            return tag, field_type, count, entries[i + 8:i + 12]
+    return None
@@ -3,89 +3,427 @@
 # Press Shift+F10 to execute it or replace it with your code.
 # Press Double Shift to search everywhere for classes, files, tool windows, actions, and settings.
 
+import argparse
+import atexit
+import json
+import multiprocessing
 import os
+import sys
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from datetime import datetime
 from PIL import Image
-from PIL.ExifTags import TAGS
 from hachoir.metadata import extractMetadata
 from hachoir.parser import createParser
 
+from dedup import find_duplicates
+from exif_reader import TAG_DATE_TIME_ORIGINAL, ExifFormatError, read_date_time_original
+from reorganise import reorganise
+from scan_cache import ScanCache
+from scan_output import OUTPUT_FORMATS, write_records
+from video_reader import VideoFormatError, read_creation_time
+
 def print_hi(name):
     # Use a breakpoint in the code line below to debug your script.
     print(f'Hi, {name}')  # Press Ctrl+F8 to toggle the breakpoint.
 
-def get_image_date_taken(path):
-    try:
-        with Image.open(path) as img:
-            exif_data = img._getexif()
-            if exif_data:
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag == 'DateTimeOriginal':
-                        return datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-    except Exception as e:
-        # Optional: log or print error
-        pass
+# Formats the header-only EXIF reader understands - everything else (and
+# files it finds malformed) goes through PIL
+FAST_EXIF_FORMATS = {'.jpg', '.jpeg', '.tif', '.tiff'}
+
+def _read_exif_date(path):
+    if os.path.splitext(path)[1].lower() in FAST_EXIF_FORMATS:
+        try:
+            return read_date_time_original(path)
+        except ExifFormatError:
+            pass
+
+    with Image.open(path) as img:
+        exif_data = img._getexif()
+        if exif_data:
+            return exif_data.get(TAG_DATE_TIME_ORIGINAL)
+    return None
+
+# Where a date came from - stored by the scan cache alongside the date
+SOURCE_EXIF = 'exif'
+SOURCE_VIDEO = 'video'
+SOURCE_MTIME = 'mtime'
 
+KIND_IMAGE = 'image'
+KIND_VIDEO = 'video'
+
+# One scanned file. kind is None for files that are neither images nor
+# videos, error holds the reason the metadata could not be read (the date
+# then comes from the modification time).
+MediaDate = namedtuple('MediaDate', ['path', 'kind', 'date', 'source', 'error'])
+
+def _describe_error(e):
+    return f'{type(e).__name__}: {e}'
+
+def _date_from_mtime(path, error=None):
     # Fallback: use file's modification time
     try:
         mod_timestamp = os.path.getmtime(path)
-        return datetime.fromtimestamp(mod_timestamp)
+        return datetime.fromtimestamp(mod_timestamp), SOURCE_MTIME, error
     except Exception as e:
-        return None
+        return None, None, error or _describe_error(e)
 
-def get_video_date_taken(path):
+def extract_image_date(path):
+    """
+    :return: (date_taken, source, error)
+    """
     try:
-        parser = createParser(path)
-        if not parser:
-            raise Exception("Parser could not be created")
-
-        with parser:
-            metadata = extractMetadata(parser)
-            if metadata:
-                # Try common video metadata tags
-                for key in ('creation_date', 'date'):
-                    if metadata.has(key):
-                        date = metadata.get(key).value
-                        if isinstance(date, datetime):
-                            return date
+        value = _read_exif_date(path)
+        if value:
+            return datetime.strptime(value, '%Y:%m:%d %H:%M:%S'), SOURCE_EXIF, None
     except Exception as e:
-        # Optional: log or print error
-        pass
+        return _date_from_mtime(path, _describe_error(e))
 
-    # Fallback: use file's modification time
+    return _date_from_mtime(path)
+
+def get_image_date_taken(path):
+    return extract_image_date(path)[0]
+
+# Containers the bounded-read video reader understands - everything else (and
+# files it finds malformed) goes through hachoir
+FAST_VIDEO_FORMATS = {'.mp4', '.mov', '.3gp', '.mkv'}
+
+# Seconds hachoir may spend on a single file before it is given up
+HACHOIR_TIMEOUT = 30
+
+def _read_video_date_with_hachoir(path):
+    parser = createParser(path)
+    if not parser:
+        raise Exception("Parser could not be created")
+
+    with parser:
+        metadata = extractMetadata(parser)
+        if metadata:
+            # Try common video metadata tags
+            for key in ('creation_date', 'date'):
+                if metadata.has(key):
+                    date = metadata.get(key).value
+                    if isinstance(date, datetime):
+                        return date
+    return None
+
+# Single-process pool that runs hachoir, so a file it gets stuck on can be
+# abandoned by killing the process. Created lazily - one per scan worker.
+# The pid it was created in is kept, because a forked scan worker inherits
+# a copy of the parent's pool that it can't use.
+_hachoir_pool = None
+_hachoir_pool_pid = None
+
+def _close_hachoir_pool():
+    global _hachoir_pool
+    # Only the process that created the pool can shut it down
+    if _hachoir_pool is not None and _hachoir_pool_pid == os.getpid():
+        _hachoir_pool.close()
+        _hachoir_pool.join()
+    _hachoir_pool = None
+
+atexit.register(_close_hachoir_pool)
+
+def _read_video_date_with_hachoir_timeout(path, timeout):
+    global _hachoir_pool, _hachoir_pool_pid
+    if not timeout:
+        return _read_video_date_with_hachoir(path)
+
+    if _hachoir_pool is None or _hachoir_pool_pid != os.getpid():
+        _hachoir_pool = multiprocessing.Pool(processes=1)
+        _hachoir_pool_pid = os.getpid()
+    result = _hachoir_pool.apply_async(_read_video_date_with_hachoir, (path,))
     try:
-        mod_timestamp = os.path.getmtime(path)
-        return datetime.fromtimestamp(mod_timestamp)
+        return result.get(timeout)
+    except multiprocessing.TimeoutError:
+        _hachoir_pool.terminate()
+        _hachoir_pool = None
+        raise TimeoutError(f"hachoir spent more than {timeout} seconds on the file")
+
+def extract_video_date(path, timeout=HACHOIR_TIMEOUT):
+    """
+    :param timeout: Seconds hachoir may spend on the file (0 or None = no limit)
+    :return: (date_taken, source, error)
+    """
+    try:
+        if os.path.splitext(path)[1].lower() in FAST_VIDEO_FORMATS:
+            try:
+                date = read_creation_time(path)
+                if date is not None:
+                    return date, SOURCE_VIDEO, None
+                return _date_from_mtime(path)
+            except VideoFormatError:
+                pass
+
+        date = _read_video_date_with_hachoir_timeout(path, timeout)
+        if date is not None:
+            return date, SOURCE_VIDEO, None
     except Exception as e:
-        return None
+        return _date_from_mtime(path, _describe_error(e))
+
+    return _date_from_mtime(path)
+
+def get_video_date_taken(path):
+    return extract_video_date(path)[0]
+
+SUPPORTED_IMAGES = {'.jpg', '.jpeg', '.png', '.heic', '.tiff'}
+SUPPORTED_VIDEOS = {'.mp4', '.mov', '.avi', '.mkv', '.3gp', '.mts'}
+
+def media_kind(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in SUPPORTED_IMAGES:
+        return KIND_IMAGE
+    if ext in SUPPORTED_VIDEOS:
+        return KIND_VIDEO
+    return None
+
+def extract_date(path, video_timeout=HACHOIR_TIMEOUT):
+    """
+    :param video_timeout: Seconds hachoir may spend on a video file (0 or None = no limit)
+    :return: MediaDate record for the file
+    """
+    kind = media_kind(path)
+    if kind == KIND_IMAGE:
+        return MediaDate(path, kind, *extract_image_date(path))
+    if kind == KIND_VIDEO:
+        return MediaDate(path, kind, *extract_video_date(path, video_timeout))
+    return MediaDate(path, None, None, None, None)
+
+def get_date_taken(path):
+    return extract_date(path).date
+
+def iter_files(root_folder, errors=None):
+    """
+    Yield an os.DirEntry for every file below root_folder.
+
+    os.scandir hands us the entry type from the directory listing itself, so
+    (unlike os.walk + os.path.isdir) no extra stat per entry is needed.
+
+    :param errors: Optional list that (folder, OSError) is appended to for every folder that couldn't be listed
+    """
+    pending = [root_folder]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(folder) as entries:
+                subfolders = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+        except OSError as e:
+            if errors is not None:
+                errors.append((folder, e))
+            continue
+        # Reverse so the folders are visited in listing order
+        pending.extend(reversed(subfolders))
+
+def _dates_for_chunk(paths, video_timeout=HACHOIR_TIMEOUT):
+    # Runs in a worker process - a whole chunk per task keeps the pickling
+    # overhead per file low
+    return [extract_date(path, video_timeout) for path in paths]
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
-def list_dates_taken(root_folder):
-    supported_images = {'.jpg', '.jpeg', '.png', '.heic', '.tiff'}
-    supported_videos = {'.mp4', '.mov', '.avi', '.mkv', '.3gp', '.mts'}
+def _split_chunk(entries, cache):
+    # Resolve what we can without opening any file: non-media files and cache
+    # hits. Returns the results with None where a file still has to be read,
+    # and the entries of those files.
+    results = []
+    misses = []
+    for entry in entries:
+        kind = media_kind(entry.path)
+        cached = None
+        if kind is None:
+            cached = (None, None, None)
+        elif cache is not None:
+            cached = cache.lookup(entry)
 
-    for root, _, files in os.walk(root_folder):
-        for name in files:
-            file_path = os.path.join(root, name)
-            ext = os.path.splitext(name)[1].lower()
+        if cached is None:
+            results.append(None)
+            misses.append(entry)
+        else:
+            results.append(MediaDate(entry.path, kind, *cached))
+    return results, misses
 
-            date_taken = None
-            if ext in supported_images:
-                date_taken = get_image_date_taken(file_path)
-            elif ext in supported_videos:
-                date_taken = get_video_date_taken(file_path)
+def _merge_chunk(results, misses, miss_results, cache):
+    if cache is not None:
+        for entry, record in zip(misses, miss_results):
+            cache.store(entry, record.date, record.source, record.error)
+    miss_results = iter(miss_results)
+    return [result if result is not None else next(miss_results) for result in results]
 
-            print(f"{file_path} -> {date_taken or 'No date found'}")
+def scan_dates_taken(root_folder, workers=None, ordered=True, chunk_size=64, cache=None,
+                     video_timeout=HACHOIR_TIMEOUT):
+    """
+    Yield a MediaDate record for every file below root_folder.
+
+    :param workers: Number of worker processes (default: number of cores). 1 scans in this process
+    :param ordered: Yield results in discovery order. If False, results are yielded as soon as they are ready
+    :param chunk_size: Number of files handed to a worker per task
+    :param cache: Optional ScanCache - unchanged files found in it are not read again
+    :param video_timeout: Seconds hachoir may spend on a video file (0 or None = no limit)
+    """
+    workers = workers or os.cpu_count() or 1
+    # A folder that couldn't be listed (maybe only for a moment) would make its
+    # cached files look deleted - the scan then doesn't count as complete
+    listing_errors = []
+    chunks = _chunked(iter_files(root_folder, listing_errors), chunk_size)
+
+    if workers == 1:
+        for chunk in chunks:
+            results, misses = _split_chunk(chunk, cache)
+            miss_results = _dates_for_chunk([entry.path for entry in misses], video_timeout)
+            yield from _merge_chunk(results, misses, miss_results, cache)
+        if cache is not None:
+            cache.flush()
+            if not listing_errors:
+                cache.scan_completed(root_folder)
+        return
+
+    # Keep a bounded number of chunks in flight, so discovery never runs far
+    # ahead of the workers and memory stays flat on huge trees
+    max_in_flight = workers * 4
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit(misses):
+            return executor.submit(_dates_for_chunk, [entry.path for entry in misses], video_timeout)
+
+        if ordered:
+            in_flight = deque()
+            for chunk in chunks:
+                results, misses = _split_chunk(chunk, cache)
+                in_flight.append((results, misses, submit(misses) if misses else None))
+                if len(in_flight) >= max_in_flight:
+                    results, misses, future = in_flight.popleft()
+                    yield from _merge_chunk(results, misses, future.result() if future else [], cache)
+            while in_flight:
+                results, misses, future = in_flight.popleft()
+                yield from _merge_chunk(results, misses, future.result() if future else [], cache)
+        else:
+            in_flight = {}
+            for chunk in chunks:
+                results, misses = _split_chunk(chunk, cache)
+                yield from (result for result in results if result is not None)
+                if not misses:
+                    continue
+                in_flight[submit(misses)] = misses
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from _merge_chunk([None] * len(in_flight[future]), in_flight.pop(future),
+                                                future.result(), cache)
+            for future in as_completed(in_flight):
+                yield from _merge_chunk([None] * len(in_flight[future]), in_flight[future],
+                                        future.result(), cache)
+
+    if cache is not None:
+        cache.flush()
+        if not listing_errors:
+            cache.scan_completed(root_folder)
+
+def list_dates_taken(root_folder, workers=1, ordered=True, cache=None, output_format='text', output=None,
+                     video_timeout=HACHOIR_TIMEOUT):
+    records = scan_dates_taken(root_folder, workers=workers, ordered=ordered, cache=cache,
+                               video_timeout=video_timeout)
+    write_records(records, output_format, output)
+
+def list_duplicates(root_folder, workers=8, cache=None, output_format='text'):
+    entries = (entry for entry in iter_files(root_folder) if media_kind(entry.path) is not None)
+    for size, content_hash, paths in find_duplicates(entries, workers=workers, cache=cache):
+        if output_format == 'jsonl':
+            print(json.dumps({'size': size, 'hash': content_hash, 'paths': paths}, ensure_ascii=False))
+        else:
+            print(f"{len(paths)} identical files of {size} bytes ({content_hash}):")
+            for path in paths:
+                print(f"    {path}")
 
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    print_hi('PyCharm')
+    # Not calling print_hi('PyCharm') any more - stdout may be a JSONL/CSV stream
 
     #date_taken =  get_image_date_taken('C:/Temp4/IMG_5481.JPEG')
     #date_taken =  get_image_date_taken('C:/Temp4/ana_i_broens.JPEG') # (None)
     #print(date_taken)
 
-    folder = 'C:/Temp4'
-    list_dates_taken(folder)
+    arg_parser = argparse.ArgumentParser(description='List the date taken for photos and videos in a folder')
+    arg_parser.add_argument('folder', nargs='?', default='C:/Temp4')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of worker processes (0 = one per core)')
+    arg_parser.add_argument('--unordered', action='store_true',
+                            help='print results as soon as they are ready instead of in discovery order')
+    arg_parser.add_argument('--video-timeout', type=float, default=HACHOIR_TIMEOUT,
+                            help='seconds hachoir may spend on a video it has to fall back to (0 = no limit)')
+    arg_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='text',
+                            help='output format - everything but text is written in buffered batches')
+    arg_parser.add_argument('--output', metavar='FILE',
+                            help='write the results to FILE instead of stdout (required for parquet)')
+    arg_parser.add_argument('--cache', metavar='DB',
+                            help='SQLite file used to skip files that are unchanged since the last scan')
+    arg_parser.add_argument('--prune', action='store_true',
+                            help='remove files from the cache that no longer exist (requires --cache, '
+                                 'not with --duplicates)')
+    arg_parser.add_argument('--invalidate', metavar='PREFIX', nargs='?', const='',
+                            help='drop cached entries below PREFIX (all if omitted) before scanning')
+    arg_parser.add_argument('--invalidate-source', choices=[SOURCE_EXIF, SOURCE_VIDEO, SOURCE_MTIME],
+                            help='only drop cached entries whose date came from this source')
+    arg_parser.add_argument('--organise', metavar='TARGET',
+                            help='instead of listing the dates, move the files into TARGET/YYYY/MM/DD folders')
+    arg_parser.add_argument('--dry-run', action='store_true',
+                            help='with --organise: only print the planned moves')
+    arg_parser.add_argument('--journal', metavar='FILE',
+                            help='with --organise: journal used to resume an interrupted run')
+    arg_parser.add_argument('--duplicates', action='store_true',
+                            help='instead of listing the dates, list groups of photos/videos with identical content')
+    arg_parser.add_argument('--hash-workers', type=int, default=8,
+                            help='with --duplicates: number of threads hashing files')
+    args = arg_parser.parse_args()
+    if args.prune and not args.cache:
+        arg_parser.error('--prune requires --cache')
+    if (args.invalidate is not None or args.invalidate_source) and not args.cache:
+        arg_parser.error('--invalidate and --invalidate-source require --cache')
+    if args.prune and args.duplicates:
+        # Finding duplicates doesn't scan the dates, so every cached date would look deleted
+        arg_parser.error('--prune can only be used when the dates are scanned, not with --duplicates')
+
+    cache = ScanCache(args.cache) if args.cache else None
+    try:
+        if cache is not None and (args.invalidate is not None or args.invalidate_source):
+            removed = cache.invalidate(prefix=args.invalidate or None, source=args.invalidate_source)
+            print(f"Invalidated {removed} cached entries", file=sys.stderr)
+
+        if args.duplicates:
+            list_duplicates(args.folder, workers=args.hash_workers, cache=cache, output_format=args.format)
+        elif args.organise:
+            summary = reorganise(
+                lambda: scan_dates_taken(args.folder, workers=args.workers, ordered=not args.unordered,
+                                         cache=cache, video_timeout=args.video_timeout),
+                args.organise, journal_path=args.journal, dry_run=args.dry_run)
+            print(f"Moved {summary['moved']}, skipped {summary['skipped']}, failed {summary['failed']}",
+                  file=sys.stderr)
+        else:
+            list_dates_taken(args.folder, workers=args.workers, ordered=not args.unordered, cache=cache,
+                             output_format=args.format, output=args.output, video_timeout=args.video_timeout)
+
+        if args.prune:
+            if cache.has_completed_scan(args.folder):
+                removed = cache.prune(args.folder)
+                print(f"Pruned {removed} deleted files from the cache", file=sys.stderr)
+            else:
+                # E.g. --organise resumed from its journal, which doesn't scan the folder again,
+                # or a subfolder couldn't be listed
+                print("Not pruning the cache - the folder wasn't scanned completely", file=sys.stderr)
+    finally:
+        if cache is not None:
+            cache.close()
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/
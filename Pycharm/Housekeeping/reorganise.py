@@ -0,0 +1,209 @@
+"""
+Move photos and videos into YYYY/MM/DD folders based on the date taken.
+
+All moves are planned up front. The plan is written to a journal before the
+first file is touched, and completed moves are appended to it, so an
+interrupted run can be resumed without scanning the archive again.
+"""
+
+import errno
+import json
+import os
+import shutil
+import sys
+
+# Number of completed moves collected before they are written to the journal
+_JOURNAL_BATCH_SIZE = 500
+
+
+def target_folder(target_root, date_taken):
+    return os.path.join(target_root, f'{date_taken:%Y}', f'{date_taken:%m}', f'{date_taken:%d}')
+
+
+def plan_moves(records, target_root):
+    """
+    Plan where every dated media file should go.
+
+    Files that are already in place are left out. A file whose name is taken
+    in its target folder (or by another planned move) gets a numeric suffix.
+
+    :param records: MediaDate records, e.g. from scan_dates_taken
+    :return: List of (source, destination) tuples
+    """
+    moves = []
+    # Names in use per target folder - listed once per folder instead of one
+    # os.path.exists per file
+    names_in_use = {}
+
+    for record in records:
+        if record.kind is None or record.date is None:
+            continue
+        folder = target_folder(target_root, record.date)
+        name = os.path.basename(record.path)
+        if os.path.normcase(os.path.dirname(os.path.abspath(record.path))) == \
+                os.path.normcase(os.path.abspath(folder)):
+            continue
+
+        if folder not in names_in_use:
+            try:
+                names_in_use[folder] = {os.path.normcase(n) for n in os.listdir(folder)}
+            except OSError:
+                names_in_use[folder] = set()
+        used = names_in_use[folder]
+
+        stem, ext = os.path.splitext(name)
+        counter = 1
+        while os.path.normcase(name) in used:
+            name = f'{stem}_{counter}{ext}'
+            counter += 1
+        used.add(os.path.normcase(name))
+        moves.append((record.path, os.path.join(folder, name)))
+
+    return moves
+
+
+class MoveJournal:
+    """
+    JSON lines file holding the planned moves followed by the indices of the completed ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.pending = []
+
+    def load(self):
+        """
+        :return: (moves, indices of completed moves), or None if there is no journal
+        """
+        if not os.path.exists(self.path):
+            return None
+        moves = []
+        done = set()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interruption
+                    continue
+                if 'done' in entry:
+                    done.update(entry['done'])
+                else:
+                    moves.append((entry['src'], entry['dst']))
+        return moves, done
+
+    def start(self, moves):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps({'src': src, 'dst': dst}) + '\n' for src, dst in moves)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def mark_done(self, index):
+        self.pending.append(index)
+        if len(self.pending) >= _JOURNAL_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps({'done': self.pending}) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _move(src, dst):
+    try:
+        # A rename is a metadata-only operation on the same device
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def execute_moves(moves, done=frozenset(), journal=None, dry_run=False):
+    """
+    Carry out planned moves.
+
+    :param done: Indices of moves that were completed by an earlier run
+    :param journal: Optional MoveJournal that completed moves are recorded in
+    :param dry_run: Only print what would be done
+    :return: Dictionary with the number of moved, skipped and failed files
+    """
+    summary = {'moved': 0, 'skipped': len(done), 'failed': 0}
+    pending = [(i, src, dst) for i, (src, dst) in enumerate(moves) if i not in done]
+
+    if dry_run:
+        for _, src, dst in pending:
+            print(f"{src} -> {dst}")
+        summary['moved'] = len(pending)
+        return summary
+
+    # Create every target folder once, up front
+    for folder in sorted({os.path.dirname(dst) for _, _, dst in pending}):
+        os.makedirs(folder, exist_ok=True)
+
+    try:
+        for i, src, dst in pending:
+            if os.path.lexists(dst):
+                if not os.path.lexists(src):
+                    # Moved by an interrupted run just before it was journaled
+                    summary['skipped'] += 1
+                    if journal is not None:
+                        journal.mark_done(i)
+                else:
+                    print(f"Not moving {src}: {dst} already exists", file=sys.stderr)
+                    summary['failed'] += 1
+                continue
+            try:
+                _move(src, dst)
+            except OSError as e:
+                print(f"Failed moving {src}: {e}", file=sys.stderr)
+                summary['failed'] += 1
+                continue
+            summary['moved'] += 1
+            if journal is not None:
+                journal.mark_done(i)
+    finally:
+        if journal is not None:
+            journal.close()
+
+    return summary
+
+
+def reorganise(records_factory, target_root, journal_path=None, dry_run=False):
+    """
+    Plan and carry out the moves of all dated media files into YYYY/MM/DD folders below target_root.
+
+    :param records_factory: Callable returning MediaDate records - not called when resuming from a journal
+    :param journal_path: Journal file - if it exists, the run it belongs to is resumed. It is removed
+        again when all moves succeeded
+    :param dry_run: Only print what would be done
+    :return: Dictionary with the number of moved, skipped and failed files
+    """
+    journal = MoveJournal(journal_path) if journal_path else None
+    loaded = journal.load() if journal is not None else None
+
+    if loaded is not None:
+        moves, done = loaded
+    else:
+        moves, done = plan_moves(records_factory(), target_root), set()
+        if journal is not None and not dry_run:
+            journal.start(moves)
+
+    summary = execute_moves(moves, done, None if dry_run else journal, dry_run)
+
+    # A finished run needs no resuming - the next run should plan afresh
+    if journal is not None and not dry_run and summary['failed'] == 0:
+        os.remove(journal_path)
+    return summary
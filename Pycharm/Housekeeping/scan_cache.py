@@ -0,0 +1,215 @@
+"""
+On-disk cache of the dates found by list_dates_taken.
+
+A file is looked up by its path and is only considered unchanged if its size,
+modification time and inode still match what was stored, so an unchanged
+archive can be rescanned without opening a single file.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+# Number of pending writes collected before they are flushed in one transaction
+_BATCH_SIZE = 1000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    date_taken TEXT,
+    source TEXT,
+    error TEXT,
+    scan_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (path, kind)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+
+class ScanCache:
+    def __init__(self, db_path):
+        self.connection = sqlite3.connect(db_path)
+        # The cache can always be rebuilt, so trade durability for speed
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(_SCHEMA)
+        self._migrate()
+        self.scan_id = self._next_scan_id()
+        self._pending_seen = []
+        self._pending_store = []
+        self._pending_hashes = []
+        # Folders a date scan has gone through completely under this scan_id
+        self._completed_scans = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _migrate(self):
+        # Caches created before errors were recorded lack the error column
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+        if 'error' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE files ADD COLUMN error TEXT')
+
+    def _next_scan_id(self):
+        with self.connection:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'scan_id'").fetchone()
+            scan_id = (row[0] if row else 0) + 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('scan_id', ?)", (scan_id,))
+        return scan_id
+
+    @staticmethod
+    def _key(entry):
+        # None if the file vanished (or can't be stat'ed) since it was listed -
+        # it is then read, and its error reported, as if there were no cache
+        try:
+            stat = entry.stat()
+            return stat.st_size, stat.st_mtime_ns, entry.inode()
+        except OSError:
+            return None
+
+    def lookup(self, entry):
+        """
+        Look up the cached result for a file.
+
+        :param entry: The os.DirEntry of the file
+        :return: (date_taken, source, error) if the file is unchanged since it was cached, otherwise None
+        """
+        row = self.connection.execute(
+            'SELECT size, mtime_ns, inode, date_taken, source, error FROM files WHERE path = ?',
+            (entry.path,)).fetchone()
+        if row is None or tuple(row[:3]) != self._key(entry):
+            return None
+
+        self._pending_seen.append((self.scan_id, entry.path))
+        if len(self._pending_seen) >= _BATCH_SIZE:
+            self.flush()
+        date_taken = datetime.fromisoformat(row[3]) if row[3] else None
+        return date_taken, row[4], row[5]
+
+    def store(self, entry, date_taken, source, error=None):
+        key = self._key(entry)
+        if key is None:
+            return
+        size, mtime_ns, inode = key
+        self._pending_store.append((
+            entry.path, size, mtime_ns, inode,
+            date_taken.isoformat() if date_taken else None, source, error, self.scan_id))
+        if len(self._pending_store) >= _BATCH_SIZE:
+            self.flush()
+
+    def lookup_hash(self, entry, kind):
+        """
+        Look up the cached content hash of a file.
+
+        :param kind: 'partial' or 'full'
+        :return: The hash if the file is unchanged since it was hashed, otherwise None
+        """
+        row = self.connection.execute(
+            'SELECT size, mtime_ns, inode, hash FROM hashes WHERE path = ? AND kind = ?',
+            (entry.path, kind)).fetchone()
+        if row is None or tuple(row[:3]) != self._key(entry):
+            return None
+        return row[3]
+
+    def store_hash(self, entry, kind, value):
+        key = self._key(entry)
+        if key is None:
+            return
+        size, mtime_ns, inode = key
+        self._pending_hashes.append((entry.path, kind, size, mtime_ns, inode, value))
+        if len(self._pending_hashes) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            if self._pending_seen:
+                self.connection.executemany(
+                    'UPDATE files SET scan_id = ? WHERE path = ?', self._pending_seen)
+            if self._pending_store:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, date_taken, source, error, scan_id) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._pending_store)
+            if self._pending_hashes:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)', self._pending_hashes)
+        self._pending_seen = []
+        self._pending_store = []
+        self._pending_hashes = []
+
+    def scan_completed(self, root_folder):
+        """
+        Record that a date scan of root_folder has looked up or stored every file below it.
+        """
+        self._completed_scans.add(os.path.abspath(root_folder))
+
+    def has_completed_scan(self, root_folder):
+        return os.path.abspath(root_folder) in self._completed_scans
+
+    def prune(self, root_folder):
+        """
+        Remove the files below root_folder that were not seen by the current scan.
+
+        :raises ValueError: If no date scan of root_folder has run to completion with this cache -
+                            every cached file below it would look deleted
+        :return: Number of removed entries
+        """
+        if not self.has_completed_scan(root_folder):
+            raise ValueError(f"No completed scan of {root_folder} to prune against")
+        self.flush()
+        prefix = os.path.join(root_folder, '')
+        with self.connection:
+            cursor = self.connection.execute(
+                'DELETE FROM files WHERE substr(path, 1, ?) = ? AND scan_id != ?',
+                (len(prefix), prefix, self.scan_id))
+            # Hashes of files that are gone from the files table are of no use either
+            self.connection.execute(
+                'DELETE FROM hashes WHERE substr(path, 1, ?) = ? AND path NOT IN (SELECT path FROM files)',
+                (len(prefix), prefix))
+        return cursor.rowcount
+
+    def invalidate(self, prefix=None, source=None):
+        """
+        Remove cached entries, so the files are read again by the next scan.
+
+        :param prefix: Only remove files whose path starts with this prefix
+        :param source: Only remove files whose date came from this source ('exif', 'video' or 'mtime')
+        :return: Number of removed entries
+        """
+        self.flush()
+        conditions = []
+        params = []
+        if prefix is not None:
+            conditions.append('substr(path, 1, ?) = ?')
+            params += [len(prefix), prefix]
+        if source is not None:
+            conditions.append('source = ?')
+            params.append(source)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self.connection:
+            cursor = self.connection.execute('DELETE FROM files' + where, params)
+            if source is None:
+                self.connection.execute('DELETE FROM hashes' + where, params)
+        return cursor.rowcount
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,140 @@
+"""
+Sinks that write MediaDate records from scan_dates_taken.
+
+All sinks buffer records and write them in batches, so writing millions of
+records doesn't turn into millions of small writes.
+"""
+
+import csv
+import json
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+OUTPUT_FORMATS = ['text', 'jsonl', 'csv', 'parquet', 'arrow']
+
+FIELDS = ['path', 'kind', 'date', 'source', 'error']
+
+# Number of records collected before they are written
+BATCH_SIZE = 10000
+
+
+def _as_dict(record):
+    row = record._asdict()
+    row['date'] = record.date.isoformat() if record.date else None
+    return row
+
+
+class TextSink:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = []
+
+    def write(self, record):
+        self.lines.append(f"{record.path} -> {record.date or 'No date found'}\n")
+        if len(self.lines) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(''.join(self.lines))
+        self.lines = []
+
+    def close(self):
+        self.flush()
+
+
+class JsonlSink(TextSink):
+    def write(self, record):
+        self.lines.append(json.dumps(_as_dict(record), ensure_ascii=False) + '\n')
+        if len(self.lines) >= BATCH_SIZE:
+            self.flush()
+
+
+class CsvSink:
+    def __init__(self, stream):
+        self.writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        self.writer.writeheader()
+        self.rows = []
+
+    def write(self, record):
+        self.rows.append(_as_dict(record))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+
+class ArrowSink:
+    """
+    Writes Parquet (to a file) or the Arrow IPC stream format (to a file or a pipe).
+
+    Every batch becomes a Parquet row group / Arrow record batch.
+    """
+
+    def __init__(self, sink, output_format):
+        if pyarrow is None:
+            raise ValueError(f"Writing {output_format} requires pyarrow (pip install pyarrow)")
+        self.schema = pyarrow.schema([
+            ('path', pyarrow.string()),
+            ('kind', pyarrow.string()),
+            ('date', pyarrow.timestamp('us')),
+            ('source', pyarrow.string()),
+            ('error', pyarrow.string()),
+        ])
+        if output_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(sink, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_stream(sink, self.schema)
+        self.columns = {field: [] for field in FIELDS}
+
+    def write(self, record):
+        for field, value in zip(FIELDS, record):
+            self.columns[field].append(value)
+        if len(self.columns['path']) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.columns['path']:
+            self.writer.write_batch(pyarrow.record_batch(
+                [self.columns[field] for field in FIELDS], schema=self.schema))
+            self.columns = {field: [] for field in FIELDS}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def write_records(records, output_format='text', output=None):
+    """
+    Write MediaDate records in the given format.
+
+    :param output_format: One of OUTPUT_FORMATS
+    :param output: File name, or None for stdout
+    """
+    if output_format in ('parquet', 'arrow'):
+        if output is None and output_format == 'parquet':
+            raise ValueError("Parquet output needs a file - use --output")
+        sink = ArrowSink(output if output is not None else sys.stdout.buffer, output_format)
+        stream = None
+    else:
+        stream = open(output, 'w', encoding='utf-8', newline='') if output is not None else sys.stdout
+        sink_types = {'text': TextSink, 'jsonl': JsonlSink, 'csv': CsvSink}
+        sink = sink_types[output_format](stream)
+
+    try:
+        for record in records:
+            sink.write(record)
+    finally:
+        sink.close()
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
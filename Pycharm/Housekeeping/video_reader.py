@@ -0,0 +1,182 @@
+"""
+Minimal video metadata reader that only looks for the creation time.
+
+For MP4/MOV/3GP files only the box headers are read (seeking past the media
+data) until moov/mvhd is found. For Matroska files only the element headers
+are read until Segment/Info/DateUTC is found. Either way a handful of small
+reads is enough, no matter how large the file is.
+"""
+
+import struct
+from datetime import datetime, timedelta
+
+# MP4 times are seconds since 1904-01-01, Matroska dates nanoseconds since 2001-01-01 (both UTC)
+MP4_EPOCH = datetime(1904, 1, 1)
+MATROSKA_EPOCH = datetime(2001, 1, 1)
+
+# Box types that may start an ISO base media file
+_MP4_FIRST_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+_EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+_EBML_ID_SEGMENT = 0x18538067
+_EBML_ID_INFO = 0x1549A966
+_EBML_ID_CLUSTER = 0x1F43B675
+_EBML_ID_DATE_UTC = 0x4461
+
+# Safety limit on the number of boxes/elements looked at per level
+_MAX_ELEMENTS = 256
+
+
+class VideoFormatError(ValueError):
+    pass
+
+
+def read_creation_time(path):
+    """
+    Read the creation time of an MP4/MOV/3GP or Matroska file.
+
+    :return: The creation time as a naive UTC datetime, or None if the file has none
+    :raises VideoFormatError: If the file is not in a supported format or is malformed
+    """
+    with open(path, 'rb') as f:
+        header = f.read(8)
+        f.seek(0)
+        if header[:4] == _EBML_MAGIC:
+            return _read_matroska_date(f)
+        if header[4:8] in _MP4_FIRST_BOXES:
+            return _read_mp4_creation_time(f)
+    raise VideoFormatError('Not an MP4 or Matroska file')
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise VideoFormatError('Truncated file')
+    return data
+
+
+def _iter_mp4_boxes(f, start, end):
+    # Yields (type, payload offset, payload size) for the boxes in [start, end)
+    offset = start
+    for _ in range(_MAX_ELEMENTS):
+        if end is not None and offset + 8 > end:
+            return
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(f, 8))[0]
+            header_size = 16
+        elif size == 0:
+            # Box extends to the end of the file (or the parent box)
+            if end is None:
+                f.seek(0, 2)
+                size = f.tell() - offset
+            else:
+                size = end - offset
+        if size < header_size:
+            raise VideoFormatError('Invalid box size')
+        yield box_type, offset + header_size, size - header_size
+        offset += size
+    raise VideoFormatError('Too many boxes')
+
+
+def _find_mp4_box(f, start, end, wanted_type):
+    for box_type, payload_offset, payload_size in _iter_mp4_boxes(f, start, end):
+        if box_type == wanted_type:
+            return payload_offset, payload_size
+    return None
+
+
+def _read_mp4_creation_time(f):
+    moov = _find_mp4_box(f, 0, None, b'moov')
+    if moov is None:
+        raise VideoFormatError('No moov box')
+    moov_offset, moov_size = moov
+    mvhd = _find_mp4_box(f, moov_offset, moov_offset + moov_size, b'mvhd')
+    if mvhd is None:
+        raise VideoFormatError('No mvhd box')
+
+    f.seek(mvhd[0])
+    version = _read_exact(f, 4)[0]
+    if version == 1:
+        seconds = struct.unpack('>Q', _read_exact(f, 8))[0]
+    else:
+        seconds = struct.unpack('>I', _read_exact(f, 4))[0]
+    # Lots of devices leave the creation time at zero
+    if seconds == 0:
+        return None
+    return MP4_EPOCH + timedelta(seconds=seconds)
+
+
+def _read_ebml_vint(f, keep_marker):
+    first = f.read(1)
+    if not first:
+        return None, 0
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise VideoFormatError('Invalid EBML variable size integer')
+    value = first if keep_marker else first & (mask - 1)
+    for byte in _read_exact(f, length - 1):
+        value = (value << 8) | byte
+    # All value bits set means "unknown size"
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, length
+
+
+def _iter_ebml_elements(f, start, end):
+    # Yields (id, data offset, data size) for the elements in [start, end).
+    # data size is None for elements of unknown size.
+    offset = start
+    for _ in range(_MAX_ELEMENTS):
+        if end is not None and offset >= end:
+            return
+        f.seek(offset)
+        element_id, id_length = _read_ebml_vint(f, keep_marker=True)
+        if element_id is None:
+            return
+        size, size_length = _read_ebml_vint(f, keep_marker=False)
+        data_offset = offset + id_length + size_length
+        yield element_id, data_offset, size
+        if size is None:
+            return
+        offset = data_offset + size
+    raise VideoFormatError('Too many EBML elements')
+
+
+def _read_matroska_date(f):
+    segment = None
+    for element_id, data_offset, size in _iter_ebml_elements(f, 0, None):
+        if element_id == _EBML_ID_SEGMENT:
+            segment = data_offset, size
+            break
+    if segment is None:
+        raise VideoFormatError('No Segment element')
+
+    segment_offset, segment_size = segment
+    segment_end = segment_offset + segment_size if segment_size is not None else None
+    for element_id, data_offset, size in _iter_ebml_elements(f, segment_offset, segment_end):
+        if element_id == _EBML_ID_INFO:
+            if size is None:
+                raise VideoFormatError('Info element of unknown size')
+            for child_id, child_offset, child_size in _iter_ebml_elements(f, data_offset, data_offset + size):
+                if child_id == _EBML_ID_DATE_UTC:
+                    if child_size != 8:
+                        raise VideoFormatError('Invalid DateUTC element')
+                    f.seek(child_offset)
+                    nanoseconds = struct.unpack('>q', _read_exact(f, 8))[0]
+                    return MATROSKA_EPOCH + timedelta(microseconds=nanoseconds // 1000)
+            return None
+        if element_id == _EBML_ID_CLUSTER or size is None:
+            # Info always comes before the media data
+            break
+    raise VideoFormatError('No Info element before the media data')
@@ -3,22 +3,34 @@
 # Press Shift+F10 to execute it or replace it with your code.
 # Press Double Shift to search everywhere for classes, files, tool windows, actions, and settings.
 
+import os
+import sys
+
 from PIL import Image
-from PIL.ExifTags import TAGS
+
+# The Exif reader is maintained in the Housekeeping project
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Housekeeping'))
+from exif_reader import TAG_DATE_TIME_ORIGINAL, ExifFormatError, read_date_time_original
 
 def print_hi(name):
     # Use a breakpoint in the code line below to debug your script.
     print(f'Hi, {name}')  # Press Ctrl+F8 to toggle the breakpoint.
 
 def get_image_date_taken(file_path):
+    # Fast path: read only the Exif header bytes of JPEG/TIFF files
+    try:
+        return read_date_time_original(file_path)
+    except ExifFormatError:
+        pass
+    except Exception as e:
+        return None
+
+    # Other formats (PNG, HEIC, ...) and malformed files go through PIL
     try:
-        image = Image.open(file_path)
-        exif_data = image._getexif()
-        if exif_data:
-            for tag_id, value in exif_data.items():
-                tag = TAGS.get(tag_id, tag_id)
-                if tag == "DateTimeOriginal":
-                    return value
+        with Image.open(file_path) as image:
+            exif_data = image._getexif()
+            if exif_data:
+                return exif_data.get(TAG_DATE_TIME_ORIGINAL)
     except Exception as e:
         pass
     return None
@@ -0,0 +1,250 @@
+"""
+Downloading of Confluence page attachments.
+
+Attachments are streamed to disk in chunks, so a 200 MB PDF never has to
+fit in memory. The data goes to "<file>.v<version>.part" first, and the
+file only gets its real name once its size (and hash, if known) has been
+verified. If a download is interrupted, the next attempt - in the same call,
+or a later run - continues where it stopped by asking the server for the
+missing range of bytes only. The attachment version in the name makes sure
+only bytes of the same version are resumed.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import requests
+
+from confluence_client import CONTENT_PATH, MAX_LIMIT, ConfluenceClient
+
+HTTP_PARTIAL_CONTENT = 206
+HTTP_RANGE_NOT_SATISFIABLE = 416
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+@dataclass
+class Download:
+    path: str
+    size: int
+    sha256: str
+    resumed_from: int = 0  # Bytes that were already on disk from an earlier attempt
+
+
+def attachment_size(attachment: dict) -> int:
+    """
+    :return: Size in bytes according to the attachment's metadata, or None if it isn't given
+    """
+    size = attachment.get("extensions", {}).get("fileSize")
+    return int(size) if size is not None else None
+
+
+def iter_attachments(client: ConfluenceClient, page_id: str, filename: str = None):
+    """
+    Yield the attachments of a page - all of them, not just the first page of the listing.
+
+    :param filename: Only the attachment with this title - the server does the filtering
+    """
+    # Title, size, media type and download link come without expansion
+    params = {"expand": "version", "limit": MAX_LIMIT}
+    if filename is not None:
+        params["filename"] = filename
+    return client.iter_results(f"{CONTENT_PATH}/{page_id}/child/attachment", params=params)
+
+
+class _IndexEntry:
+
+    def __init__(self, version: int):
+        self.version = version
+        self.complete = False  # All attachments of the page are in by_title
+        self.by_title = {}
+        self.missing = set()  # Titles looked up that the page doesn't have
+
+
+class AttachmentIndex:
+    """
+    The attachments of pages by title, cached per page id and page version.
+
+    A lookup only costs a request for the page version - none if the caller
+    knows it already - when the page has been indexed at that version.
+    """
+
+    def __init__(self, client: ConfluenceClient, max_pages: int = 256):
+        """
+        :param max_pages: Number of pages to keep the attachments of - the least recently used are dropped
+        """
+        self.client = client
+        self.max_pages = max_pages
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _entry(self, page_id: str, version: int) -> _IndexEntry:
+        if version is None:
+            version = self.client.read_page(page_id, with_body=False).version
+        with self.lock:
+            entry = self.entries.get(page_id)
+            if entry is None or entry.version != version:
+                entry = self.entries[page_id] = _IndexEntry(version)
+                if len(self.entries) > self.max_pages:
+                    self.entries.popitem(last=False)
+            self.entries.move_to_end(page_id)
+            return entry
+
+    def attachments(self, page_id: str, version: int = None) -> dict[str, dict]:
+        """
+        :param version: The current version of the page, if known - saves a request
+        :return: Title -> attachment, for all attachments of the page
+        """
+        entry = self._entry(page_id, version)
+        if not entry.complete:
+            entry.by_title = {attachment["title"]: attachment for attachment in iter_attachments(self.client, page_id)}
+            entry.missing.clear()
+            entry.complete = True
+        return entry.by_title
+
+    def find(self, page_id: str, title: str, version: int = None) -> dict:
+        """
+        :return: The attachment of the page with the given title, or None if the page has no such attachment
+        """
+        entry = self._entry(page_id, version)
+        if title in entry.by_title:
+            return entry.by_title[title]
+        if entry.complete or title in entry.missing:
+            return None
+        # Let the server find it, rather than listing all attachments of the page
+        attachment = next(iter_attachments(self.client, page_id, filename=title), None)
+        if attachment is None:
+            entry.missing.add(title)
+        else:
+            entry.by_title[title] = attachment
+        return attachment
+
+
+def _part_path(path: str, attachment: dict) -> str:
+    version = attachment.get("version", {}).get("number")
+    return f"{path}.v{version}.part" if version is not None else path + ".part"
+
+
+def _remove_stale_parts(path: str, part_path: str):
+    # Partial downloads of other versions of the attachment can't be resumed. Only this
+    # attachment's though - "X.png" may be downloading next to "X" at the same time
+    folder, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r"(\.v\d+)?\.part")
+    for other in os.listdir(folder or "."):
+        other_path = os.path.join(folder, other)
+        if pattern.fullmatch(other) and other_path != part_path:
+            os.remove(other_path)
+
+
+def _hash_file(path: str, digest):
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+
+def download_attachment(client: ConfluenceClient, attachment: dict, path: str,
+                        expected_sha256: str = None, max_attempts: int = 3) -> Download:
+    """
+    Download an attachment to a file, resuming an earlier attempt if there is one.
+
+    :param attachment: As listed by iter_attachments (with its version)
+    :param expected_sha256: Hex digest the file must have - the size is always checked, if the server gave it
+    :param max_attempts: Number of tries when the connection breaks during the download
+    """
+    expected_size = attachment_size(attachment)
+    part_path = _part_path(path, attachment)
+    url = attachment["_links"]["download"]
+    _remove_stale_parts(path, part_path)
+
+    resumed_from = 0
+    for attempt in range(1, max_attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if expected_size is not None and offset > expected_size:
+            # Can't be the start of this attachment
+            os.remove(part_path)
+            offset = 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = None
+        try:
+            response = client.request("GET", url, headers=headers, stream=True)
+            if response.status_code == HTTP_RANGE_NOT_SATISFIABLE:
+                if offset == expected_size:
+                    # The earlier attempt got everything, only the rename was missing
+                    break
+                # The server doesn't agree that there is more to get - start over
+                os.remove(part_path)
+                continue
+            response.raise_for_status()
+            if response.status_code == HTTP_PARTIAL_CONTENT:
+                if not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                    raise DownloadError(f"{attachment['title']}: unexpected Content-Range "
+                                        f"{response.headers.get('Content-Range')}")
+                resumed_from = offset
+            else:
+                # The server sends the whole file (no Range support, or nothing to resume)
+                offset = resumed_from = 0
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            # What was written so far is kept for the next attempt
+            if attempt == max_attempts:
+                raise
+        finally:
+            if response is not None:
+                response.close()
+    else:
+        raise DownloadError(f"{attachment['title']}: no complete download in {max_attempts} attempts")
+
+    size = os.path.getsize(part_path)
+    digest = hashlib.sha256()
+    _hash_file(part_path, digest)
+    sha256 = digest.hexdigest()
+    if expected_size is not None and size != expected_size:
+        os.remove(part_path)
+        raise DownloadError(f"{attachment['title']}: got {size} bytes, expected {expected_size}")
+    if expected_sha256 is not None and sha256 != expected_sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"{attachment['title']}: SHA-256 {sha256}, expected {expected_sha256}")
+
+    os.replace(part_path, path)
+    return Download(path, size, sha256, resumed_from)
+
+
+def download_attachments(client: ConfluenceClient, page_ids: list[str], folder: str,
+                         max_workers: int = 4, skip_existing: bool = True):
+    """
+    Download all attachments of a number of pages (e.g. a page tree) to folder/<page id>/<title>.
+
+    Yield a Download - or the attachment and the exception - for each attachment, as they complete.
+
+    :param max_workers: Number of downloads at the same time
+    :param skip_existing: Don't download attachments that are already on disk with the right size
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for page_id in page_ids:
+            page_folder = os.path.join(folder, page_id)
+            os.makedirs(page_folder, exist_ok=True)
+            for attachment in iter_attachments(client, page_id):
+                # Titles are file names, but don't let one escape the folder
+                path = os.path.join(page_folder, os.path.basename(attachment["title"]))
+                if skip_existing and os.path.exists(path) and os.path.getsize(path) == attachment_size(attachment):
+                    continue
+                futures[executor.submit(download_attachment, client, attachment, path)] = attachment
+
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except (requests.RequestException, DownloadError, OSError) as e:
+                yield futures[future], e
@@ -0,0 +1,419 @@
+"""
+Client for the Confluence REST API.
+
+All requests of a ConfluenceClient go through one requests.Session, so the
+TCP/TLS connection to the server is set up once and kept alive, instead of
+once per call. AsyncConfluenceClient does the same on top of httpx and lets
+many requests be in flight at once, up to a configurable limit.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from request_scheduler import RequestScheduler
+from storage_hash import same_storage, storage_hash
+
+try:
+    import httpx  # pip install httpx - only needed for AsyncConfluenceClient
+except ImportError:
+    httpx = None
+
+CONTENT_PATH = "/rest/api/content"
+
+HTTP_CONFLICT = 409
+
+
+class PageConflictError(requests.HTTPError):
+    """
+    The page was changed by someone else since it was read.
+    """
+
+# Largest page size the server accepts for content listings
+MAX_LIMIT = 200
+
+
+@dataclass
+class Page:
+    """
+    A Confluence page as returned by one fetch - enough to update it without reading it again.
+    """
+    id: str
+    title: str
+    version: int
+    body: str = None  # Storage format - None if the body wasn't expanded
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Page":
+        body = data.get("body", {}).get("storage", {}).get("value")
+        return cls(id=data["id"], title=data["title"], version=data["version"]["number"], body=body)
+
+    def update_payload(self, new_body: str, title: str = None) -> dict:
+        return {
+            "id": self.id,
+            "type": "page",
+            "title": title or self.title,  # must include title unchanged (unless renaming)
+            "version": {"number": self.version + 1},
+            "body": {
+                "storage": {
+                    "value": new_body,
+                    "representation": "storage"
+                }
+            }
+        }
+
+
+@dataclass
+class PageInfo:
+    """
+    Metadata of a page found while walking a page tree.
+    """
+    id: str
+    title: str
+    version: int
+    ancestors: tuple[str, ...]  # Ids from the root of the space down to the parent
+
+
+class ConfluenceClient:
+
+    def __init__(self, base_url: str, token: str, timeout: float = 30, pool_size: int = 10,
+                 scheduler: RequestScheduler = None):
+        """
+        :param base_url: E.g. https://confluence.dmi.dk
+        :param token: Personal access token
+        :param timeout: Seconds to wait for the server before giving up on a request
+        :param pool_size: Number of keep-alive connections - should be at least the number of threads using the client
+        :param scheduler: Rate limit and retries of throttled requests - defaults to 20 requests/second,
+                          and pool_size requests in flight
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.scheduler = scheduler or RequestScheduler(max_per_host=pool_size)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json"
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def url(self, path: str) -> str:
+        # Links returned by the API (e.g. _links.next) are relative to the base url
+        return path if path.startswith("http") else f"{self.base_url}{path}"
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the scheduler - throttled requests (429/503) are retried, as far as it is safe
+        (see RequestScheduler.retryable).
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        return self.scheduler.send(lambda: self.session.request(method, url, **kwargs), url, method)
+
+    def get_json(self, path: str, params: dict = None) -> dict:
+        response = self.request("GET", path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def get_page(self, page_id: str, expand: str = "body.storage,version") -> dict:
+        return self.get_json(f"{CONTENT_PATH}/{page_id}", params={"expand": expand})
+
+    def create_page(self, data: dict) -> requests.Response:
+        return self.request("POST", f"{CONTENT_PATH}/", json=data)
+
+    def put_page(self, page_id: str, data: dict) -> requests.Response:
+        return self.request("PUT", f"{CONTENT_PATH}/{page_id}", json=data)
+
+    def get_child_pages(self, page_id: str, params: dict = None) -> dict:
+        return self.get_json(f"{CONTENT_PATH}/{page_id}/child/page", params=params)
+
+    def get_attachments(self, page_id: str, params: dict = None) -> dict:
+        return self.get_json(f"{CONTENT_PATH}/{page_id}/child/attachment", params=params)
+
+    def iter_results(self, path: str, params: dict = None):
+        """
+        Yield the results of a paginated listing, following _links.next until the last page.
+        """
+        data = self.get_json(path, params=params)
+        while True:
+            yield from data.get("results", [])
+            next_link = data.get("_links", {}).get("next")
+            if not next_link:
+                return
+            # The next link already carries all query parameters
+            data = self.get_json(next_link)
+
+    def iter_child_pages(self, page_id: str, expand: str = "version", limit: int = MAX_LIMIT):
+        return self.iter_results(f"{CONTENT_PATH}/{page_id}/child/page",
+                                 params={"expand": expand, "limit": limit})
+
+    def walk_page_tree(self, root_id: str, max_workers: int = 8):
+        """
+        Yield a PageInfo for every page below root_id (not the root itself).
+
+        The pages are found with a single 'ancestor = root_id' CQL search, so
+        pages without children cost no requests of their own. The result pages
+        of the search are requested up to max_workers at a time, and only the
+        result pages in flight are kept in memory. The search index may lag a
+        moment behind very recent changes to the tree.
+        """
+        for result in self._search_parallel(f"ancestor = {root_id} and type = page", "version,ancestors",
+                                            MAX_LIMIT, max_workers):
+            yield PageInfo(result["id"], result["title"], result["version"]["number"],
+                           tuple(ancestor["id"] for ancestor in result.get("ancestors", [])))
+
+    def search(self, cql: str, expand: str = "version", limit: int = MAX_LIMIT):
+        """
+        Yield the results of a CQL content search, e.g. 'space = ESP and type = page'.
+        """
+        return self.iter_results(f"{CONTENT_PATH}/search", params={"cql": cql, "expand": expand, "limit": limit})
+
+    def search_pages(self, cql: str, expand: str = "body.storage,version", limit: int = MAX_LIMIT,
+                     max_workers: int = 4):
+        """
+        Yield a Page for every result of a CQL search, e.g. 'ancestor = 222553283 and type = page'.
+
+        The first request tells how many results there are, and the rest of
+        the result pages are then requested in parallel (up to max_workers at
+        a time). Pages are yielded in the order of the search, as they arrive.
+        """
+        return map(Page.from_json, self._search_parallel(cql, expand, limit, max_workers))
+
+    def _search_parallel(self, cql: str, expand: str, limit: int, max_workers: int):
+        path = f"{CONTENT_PATH}/search"
+        params = {"cql": cql, "expand": expand, "limit": limit}
+        data = self.get_json(path, params=params)
+        yield from data.get("results", [])
+
+        total = data.get("totalSize")
+        # The server may return fewer results per request than asked for (e.g. when bodies are expanded)
+        step = data.get("limit") or len(data.get("results", []))
+        if total is None or not step:
+            # Without a total the result pages can only be followed one by one
+            next_link = data.get("_links", {}).get("next")
+            if next_link:
+                yield from self.iter_results(next_link)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = deque()
+            for start in range(data.get("start", 0) + step, total, step):
+                in_flight.append(executor.submit(self.get_json, path, {**params, "start": start, "limit": step}))
+                if len(in_flight) >= 2 * max_workers:
+                    yield from in_flight.popleft().result().get("results", [])
+            while in_flight:
+                yield from in_flight.popleft().result().get("results", [])
+
+    def read_pages(self, page_ids: list[str], expand: str = "body.storage,version", batch_size: int = 50,
+                   max_workers: int = 4):
+        """
+        Yield the given pages, reading batch_size pages per request with an 'id in (...)' search.
+
+        Batches are read in parallel, and pages are yielded batch by batch in
+        the order of page_ids. Pages that don't exist (or can't be seen) are
+        left out.
+        """
+        def read_batch(batch: list[str]) -> list[Page]:
+            pages = {}
+            for result in self.search(f"id in ({','.join(batch)})", expand=expand, limit=len(batch)):
+                page = Page.from_json(result)
+                pages[page.id] = page
+            return [pages[page_id] for page_id in batch if page_id in pages]
+
+        batches = [page_ids[start:start + batch_size] for start in range(0, len(page_ids), batch_size)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append(executor.submit(read_batch, batch))
+                if len(in_flight) >= 2 * max_workers:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def read_page_cached(self, page_id: str, cache) -> Page:
+        """
+        Read a page, taking the body from a PageCache if the page hasn't changed.
+
+        Costs one small metadata request when the cached body is current,
+        plus the body download when it isn't.
+        """
+        current = self.read_page(page_id, with_body=False)
+        page = cache.get(page_id, current.version)
+        if page is None:
+            page = self.read_page(page_id)
+            cache.put(page)
+        return page
+
+    def read_pages_cached(self, page_ids: list[str], cache, batch_size: int = 50) -> list[Page]:
+        """
+        Read many pages, taking the bodies from a PageCache where they haven't changed.
+
+        Versions are checked with one CQL search per batch of pages, and the
+        bodies of changed pages are fetched with another. Pages that don't
+        exist (or can't be seen) are left out.
+        """
+        pages = {}
+        for start in range(0, len(page_ids), batch_size):
+            batch = page_ids[start:start + batch_size]
+            changed = []
+            for result in self.search(f"id in ({','.join(batch)})", expand="version", limit=len(batch)):
+                page = cache.get(result["id"], result["version"]["number"])
+                if page is None:
+                    changed.append(result["id"])
+                else:
+                    pages[page.id] = page
+            for page in self.read_pages(changed, batch_size=batch_size, max_workers=1):
+                cache.put(page)
+                pages[page.id] = page
+        return [pages[page_id] for page_id in page_ids if page_id in pages]
+
+    def read_page(self, page_id: str, with_body: bool = True) -> Page:
+        return Page.from_json(self.get_page(page_id, "body.storage,version" if with_body else "version"))
+
+    def update_page(self, page: Page, new_body: str, title: str = None, max_conflicts: int = 3,
+                    pushed_hashes=None, overwrite: bool = False) -> Page:
+        """
+        Replace the body of a page that was read earlier.
+
+        No request is made to read the current version - the update is sent
+        right away. If the page was changed in the meantime the server answers
+        409, and PageConflictError is raised - unless overwrite is set, then
+        the version is read again and the update retried, overwriting the
+        other change. Use edit_page if the body is derived from the current one.
+
+        Nothing is sent if the new body is the same as the page's body (see
+        storage_hash), or as the body last pushed to the page, if the page
+        is still at the version that push created.
+
+        :param pushed_hashes: PushedHashes - hashes of the bodies pushed earlier, updated on success
+        :param overwrite: Replace the body even if the page was changed since it was read
+        :return: The page as it is after the update
+        """
+        new_hash = storage_hash(new_body)
+        if title is None or title == page.title:
+            if page.body is not None and (page.body == new_body or storage_hash(page.body) == new_hash):
+                return page
+            if pushed_hashes is not None and pushed_hashes.get(page.id, page.version) == new_hash:
+                return Page(id=page.id, title=page.title, version=page.version, body=new_body)
+
+        for _ in range(max_conflicts + 1):
+            response = self.put_page(page.id, page.update_payload(new_body, title))
+            if response.status_code != HTTP_CONFLICT:
+                break
+            if not overwrite:
+                raise PageConflictError(f"Page {page.id} was changed since version {page.version}",
+                                        response=response)
+            page = self.read_page(page.id, with_body=False)
+        response.raise_for_status()
+        data = response.json()
+        updated_page = Page(id=page.id, title=data["title"], version=data["version"]["number"], body=new_body)
+        if pushed_hashes is not None:
+            pushed_hashes.put(page.id, updated_page.version, new_hash)
+        return updated_page
+
+    def edit_page(self, page_id: str, edit, page: Page = None, max_conflicts: int = 3) -> Page:
+        """
+        Read-modify-write of a page body.
+
+        :param edit: Function taking the current storage format and returning the new one
+        :param page: The page, if it has been read already - saves the initial read
+        :return: The page as it is after the update - the page as it was, if the edit didn't change it
+        """
+        page = page or self.read_page(page_id)
+        for _ in range(max_conflicts + 1):
+            new_body = edit(page.body)
+            if same_storage(page.body, new_body):
+                return page
+            response = self.put_page(page.id, page.update_payload(new_body))
+            if response.status_code != HTTP_CONFLICT:
+                break
+            # Someone else changed the page - apply the edit to their version
+            page = self.read_page(page_id)
+        response.raise_for_status()
+        data = response.json()
+        return Page(id=page.id, title=data["title"], version=data["version"]["number"], body=new_body)
+
+
+class AsyncConfluenceClient:
+    """
+    asyncio variant of ConfluenceClient, e.g.
+
+        async with AsyncConfluenceClient(base_url, token, concurrency=20) as client:
+            pages = await client.get_pages(page_ids)
+    """
+
+    def __init__(self, base_url: str, token: str, timeout: float = 30, concurrency: int = 10,
+                 scheduler: RequestScheduler = None):
+        """
+        :param concurrency: Maximum number of requests in flight at the same time
+        :param scheduler: See ConfluenceClient - may be shared with one
+        """
+        if httpx is None:
+            raise ImportError("AsyncConfluenceClient requires httpx (pip install httpx)")
+        self.base_url = base_url.rstrip("/")
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.scheduler = scheduler or RequestScheduler(max_per_host=concurrency)
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json"
+            },
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    def url(self, path: str) -> str:
+        return path if path.startswith("http") else f"{self.base_url}{path}"
+
+    async def request(self, method: str, path: str, **kwargs):
+        url = self.url(path)
+        async with self.semaphore:
+            return await self.scheduler.send_async(lambda: self.client.request(method, url, **kwargs), url,
+                                                   method)
+
+    async def get_json(self, path: str, params: dict = None) -> dict:
+        response = await self.request("GET", path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_page(self, page_id: str, expand: str = "body.storage,version") -> dict:
+        return await self.get_json(f"{CONTENT_PATH}/{page_id}", params={"expand": expand})
+
+    async def get_pages(self, page_ids: list[str], expand: str = "body.storage,version") -> list[dict]:
+        # The semaphore keeps the number of concurrent requests bounded
+        return await asyncio.gather(*(self.get_page(page_id, expand) for page_id in page_ids))
+
+    async def create_page(self, data: dict):
+        return await self.request("POST", f"{CONTENT_PATH}/", json=data)
+
+    async def put_page(self, page_id: str, data: dict):
+        return await self.request("PUT", f"{CONTENT_PATH}/{page_id}", json=data)
+
+    async def get_child_pages(self, page_id: str, params: dict = None) -> dict:
+        return await self.get_json(f"{CONTENT_PATH}/{page_id}/child/page", params=params)
+
+    async def get_attachments(self, page_id: str, params: dict = None) -> dict:
+        return await self.get_json(f"{CONTENT_PATH}/{page_id}/child/attachment", params=params)
@@ -0,0 +1,179 @@
+"""
+Extraction of the shapes and connections of a draw.io diagram.
+
+The diagram file is read incrementally, and every cell is dropped from the
+tree as soon as it has been turned into a record, so memory stays bounded
+even for diagrams with tens of thousands of cells. A compressed diagram
+(base64 of raw deflate of URL-encoded XML, the default in older draw.io
+versions) is inflated and parsed chunk by chunk as well.
+
+Styles (e.g. "rounded=1;fillColor=#dae8fc;strokeColor=#6c8ebf;") repeat
+across most cells of a diagram, so they are parsed once per distinct style.
+"""
+
+import base64
+import re
+import xml.etree.ElementTree as ET
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+from urllib.parse import unquote_to_bytes
+
+# A shape. x/y/width/height are None if the cell has no geometry
+Vertex = namedtuple('Vertex', ['id', 'parent', 'value', 'style', 'x', 'y', 'width', 'height', 'diagram'])
+
+# A connection between two shapes. source/target are None for a dangling end
+Edge = namedtuple('Edge', ['id', 'parent', 'value', 'style', 'source', 'target', 'diagram'])
+
+# Elements that wrap a cell to give it an id, a label and custom properties
+WRAPPER_TAGS = ("UserObject", "object")
+
+CHUNK_SIZE = 64 * 1024
+
+_PERCENT_ESCAPE_TAIL = re.compile(rb"%[0-9A-Fa-f]?$")
+
+
+@lru_cache(maxsize=4096)
+def parse_style(style: str):
+    """
+    Convert a draw.io style string into a (read-only) mapping - e.g. "ellipse;fillColor=#fff" gives
+    {"ellipse": "", "fillColor": "#fff"}.
+    """
+    style_dict = {}
+    for item in style.split(";"):
+        if not item:
+            continue
+        key, _, value = item.partition("=")
+        style_dict[key] = value
+    # Shared by every cell with this style, so it mustn't be changed
+    return MappingProxyType(style_dict)
+
+
+def _inflate(text: str):
+    """
+    Yield the XML of a compressed diagram in chunks of bytes.
+    """
+    data = base64.b64decode(text)
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    pending = b""
+    while data:
+        # Diagrams compress very well, so limit the output rather than the input
+        pending += decompressor.decompress(data, CHUNK_SIZE)
+        data = decompressor.unconsumed_tail
+        # Don't split a %XX escape between two chunks
+        tail = _PERCENT_ESCAPE_TAIL.search(pending[-2:])
+        cut = len(pending) - (len(tail.group(0)) if tail else 0)
+        yield unquote_to_bytes(pending[:cut])
+        pending = pending[cut:]
+    yield unquote_to_bytes(pending + decompressor.flush())
+
+
+def _number(attributes: dict, name: str) -> float:
+    # draw.io leaves out coordinates that are 0
+    return float(attributes.get(name, 0))
+
+
+class _CellReader:
+    """
+    Turns the start/end events of an mxGraphModel into Vertex and Edge records.
+    """
+
+    def __init__(self, diagram: str):
+        self.diagram = diagram
+        self.wrappers = []  # Attributes of the UserObjects being read
+        self.root = None  # The <root> element, emptied as its cells are read
+        self.depth = 0
+
+    def handle(self, event: str, element: ET.Element):
+        if event == "start":
+            self.depth += 1
+            if element.tag == "root" and self.root is None:
+                self.root = element
+                self.root_depth = self.depth
+            elif element.tag in WRAPPER_TAGS:
+                self.wrappers.append(element.attrib)
+            return None
+
+        self.depth -= 1
+        record = None
+        if element.tag == "mxCell":
+            record = self._record(element)
+        elif element.tag in WRAPPER_TAGS:
+            self.wrappers.pop()
+        if self.root is not None and self.depth == self.root_depth:
+            # A cell (or its wrapper) directly in <root> is done - let it go
+            self.root.clear()
+        return record
+
+    def _record(self, cell: ET.Element):
+        attributes = cell.attrib
+        cell_id = attributes.get("id")
+        value = attributes.get("value", "")
+        if self.wrappers:
+            wrapper = self.wrappers[-1]
+            cell_id = wrapper.get("id", cell_id)
+            value = wrapper.get("label", value)
+        style = parse_style(attributes.get("style", ""))
+        parent = attributes.get("parent")
+
+        if attributes.get("edge") == "1":
+            return Edge(cell_id, parent, value, style, attributes.get("source"), attributes.get("target"),
+                        self.diagram)
+        if attributes.get("vertex") == "1":
+            geometry = cell.find("mxGeometry")
+            if geometry is None:
+                x = y = width = height = None
+            else:
+                geometry = geometry.attrib
+                x, y = _number(geometry, "x"), _number(geometry, "y")
+                width, height = _number(geometry, "width"), _number(geometry, "height")
+            return Vertex(cell_id, parent, value, style, x, y, width, height, self.diagram)
+        # The layers and the invisible root cell
+        return None
+
+
+def _iter_compressed(text: str, diagram: str):
+    reader = _CellReader(diagram)
+    parser = ET.XMLPullParser(events=("start", "end"))
+    for chunk in _inflate(text):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            record = reader.handle(event, element)
+            if record is not None:
+                yield record
+    parser.close()
+    for event, element in parser.read_events():
+        record = reader.handle(event, element)
+        if record is not None:
+            yield record
+
+
+def iter_cells(source):
+    """
+    Yield a Vertex or an Edge for every shape and connection of a draw.io file, page by page.
+
+    :param source: File name or binary file object of an .drawio file (or of a bare mxGraphModel)
+    """
+    reader = _CellReader(diagram=None)
+    diagram_depth = None
+    depth = 0
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if element.tag == "diagram":
+                reader = _CellReader(element.get("name"))
+                diagram_depth = depth
+            else:
+                reader.handle(event, element)
+            continue
+
+        depth -= 1
+        if element.tag == "diagram" and depth == diagram_depth - 1:
+            if len(element) == 0 and element.text and element.text.strip():
+                yield from _iter_compressed(element.text.strip(), element.get("name"))
+            element.clear()
+            continue
+        record = reader.handle(event, element)
+        if record is not None:
+            yield record
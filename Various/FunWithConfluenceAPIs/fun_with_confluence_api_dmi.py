@@ -1,148 +1,114 @@
 import sys
 import os
 import json
-import requests
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup  # reformatting of html - here content of a Confluence page
+from urllib.parse import quote
+
+from attachments import AttachmentIndex, download_attachment, download_attachments
+from confluence_client import ConfluenceClient, Page
+from drawio import Edge, iter_cells
+from markdown_publish import publish_markdown_folder
+from page_cache import PageCache
+from section_rollout import rollout_section, rollout_section_order
+from space_sync import sync_folder
+from storage_document import StorageDocument
+from storage_hash import PushedHashes
+from storage_templates import StorageBuilder
 
 base_url = "https://confluence.dmi.dk"
 personal_access_token = os.environ.get("ATLASSIAN_API_TOKEN_DMI")
 gitlab_access_token = os.environ.get("GITLAB_TOKEN")
 
-def retrieve_attachment_info(page_id, attachment_name):
-    url = f"{base_url}/rest/api/content/{page_id}/child/attachment"
-    params = {"expand": "body.storage,version"}
-    headers = {"Authorization": f"Bearer {personal_access_token}"}
-
-    response = requests.get(
-        url,
-        headers=headers,
-        params=params
-    )
+# Shared by all the functions below, so they reuse the same keep-alive connections
+client = ConfluenceClient(base_url, personal_access_token)
 
-    links = None
+# If set, retrieve_page only downloads a body when the page version has changed
+page_cache: PageCache = None
 
-    if response.status_code == 200:
-        data = response.json()
-        results = data['results']
-        for result in results:
-            attachment_id = result['id']
-            title = result['title']
-            #print(f"Attachment ID: {attachment_id}, Title: {title}")
+# If set, updates are skipped when the body is the same as the one last pushed to the page
+pushed_hashes: PushedHashes = None
 
-            if title == attachment_name:
-                print(f"Found attachment with ID: {attachment_id} and title: {title}")
-                links = result['_links']
-                break
+# Attachments by title, per page version
+attachment_index = AttachmentIndex(client)
 
-    if links is not None:
-        pass
+def retrieve_attachment_info(page_id, attachment_name):
+    attachment = attachment_index.find(page_id, attachment_name)
 
-    download = links['download']
+    if attachment is None:
+        print(f"Page {page_id} has no attachment with title: {attachment_name}")
+        return
 
-    url = f"{base_url}{download}"
-    headers = {"Authorization": f"Bearer {personal_access_token}"}
-
-    response = requests.get(
-        url,
-        headers=headers
-    )
+    print(f"Found attachment with ID: {attachment['id']} and title: {attachment['title']}")
 
     # THIS IS THE XML CONTENT OF THE DRAW.IO FILE !!!!!
-    text = response.text
-
-    # Write it to file, just for fun
+    # Streamed to file, so a large attachment is never held in memory
     output_filename = "diagram.drawio.xml"
 
-    with open(output_filename, "w", encoding="utf-8") as f:
-        f.write(text)    
-
-    # Extraxt rectangles from the XML content
-    root = ET.fromstring(text)
-
-    # --- STEP 2: find all <mxCell> elements ---
-    mx_cells = root.findall(".//mxCell")
-    print(f"Found {len(mx_cells)} mxCell elements")
-
-    # Her har vi så lige en embedded funktion
-    # --- STEP 3: parse attributes and style ---
-    def parse_style(style_str):
-        """Convert draw.io style string into a dict"""
-        style_dict = {}
-        for item in style_str.split(";"):
-            if "=" in item:
-                key, val = item.split("=", 1)
-                style_dict[key] = val
-        return style_dict
-        
-    for cell in mx_cells:
-        value = cell.attrib.get("value", "")
-        style = cell.attrib.get("style", "")
-        style_dict = parse_style(style)
-        stroke_color = style_dict.get("strokeColor", "")
-        fill_color = style_dict.get("fillColor", "")
-
-        # geometry info (if present)
-        geometry = cell.find("mxGeometry")
-        if geometry is not None:
-            x = geometry.attrib.get("x")
-            y = geometry.attrib.get("y")
-            width = geometry.attrib.get("width")
-            height = geometry.attrib.get("height")
-        else:
-            x = y = width = height = None        
+    download_attachment(client, attachment, output_filename)
 
-        print(f"Value: {value}")
-        print(f"Stroke: {stroke_color}, Fill: {fill_color}")
-        print(f"x={x}, y={y}, width={width}, height={height}")
+    # Extraxt rectangles from the XML content - read incrementally, also if the diagram is compressed
+    vertex_count = edge_count = 0
+    for cell in iter_cells(output_filename):
+        if isinstance(cell, Edge):
+            edge_count += 1
+            print(f"Edge: {cell.source} -> {cell.target} {cell.value}")
+        else:
+            vertex_count += 1
+            print(f"Value: {cell.value}")
+            print(f"Stroke: {cell.style.get('strokeColor', '')}, Fill: {cell.style.get('fillColor', '')}")
+            print(f"x={cell.x}, y={cell.y}, width={cell.width}, height={cell.height}")
         print("---")
 
-    pass
+    print(f"Found {vertex_count} shapes and {edge_count} connections")
 
-def retrieve_page_content(page_id) -> str:
-    url = f"{base_url}/rest/api/content/{page_id}"
-    params = {"expand": "body.storage,version"}
-    headers = {"Authorization": f"Bearer {personal_access_token}"}
-
-    response = requests.get(
-        url,
-        headers=headers,
-        params=params
+def retrieve_page(page_id) -> Page:
+    if page_cache is not None:
+        page = client.read_page_cached(page_id, page_cache)
+
+        print(f"Title: {page.title}")
+        print(f"Version: {page.version}")
+        print("Content:\n", page.body)
+
+        return page
+
+    response = client.request(
+        "GET",
+        f"/rest/api/content/{page_id}",
+        params={"expand": "body.storage,version"}
     )
 
     if response.status_code == 200:
-        data = response.json()
-        title = data["title"]
-        version = data["version"]["number"]
-        content = data["body"]["storage"]["value"]
+        page = Page.from_json(response.json())
 
-        print(f"Title: {title}")
-        print(f"Version: {version}")
-        print("Content:\n", content)
+        print(f"Title: {page.title}")
+        print(f"Version: {page.version}")
+        print("Content:\n", page.body)
 
-        return content
+        return page
     else:
         raise Exception('Failed retrieving content of Confluence page - wrong page id?')
 
+def retrieve_page_content(page_id) -> str:
+    return retrieve_page(page_id).body
 
-def create_confluence_page(space_key: str, parent_page_id: str, title: str, data: dict[str, any]): 
+def retrieve_pages(page_ids: list[str] = None, cql: str = None):
+    """
+    Yield many pages with their bodies - 50 or more pages per request instead of one.
 
-    url = f"{base_url}/rest/api/content/"
+    :param page_ids: The pages to read (missing pages are left out)
+    :param cql: Alternative to page_ids, e.g. 'ancestor = 222553283' or 'space = ESP and lastmodified > "2025-01-01"'
+    """
+    if cql is not None:
+        return client.search_pages(cql)
+    return client.read_pages(page_ids)
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {personal_access_token}"
-    }
+
+def create_confluence_page(space_key: str, parent_page_id: str, title: str, data: dict[str, any]): 
 
     data["space"] = {"key": space_key}
     data["ancestors"] = [{"id": parent_page_id}] # omit if creating at root of space
     data["title"] = title
 
-    response = requests.post(
-        url,
-        data=json.dumps(data),
-        headers=headers
-    )
+    response = client.create_page(data)
 
     # ----- Check result -----
     if response.status_code == 200 or response.status_code == 201:
@@ -153,107 +119,56 @@ def create_confluence_page(space_key: str, parent_page_id: str, title: str, data
         print("Failed to create page:", response.status_code, response.text)
 
 def update_confluence_page_with_hello_world_message(page_id: str):
-    
-    headers = {
-        "Authorization": f"Bearer {personal_access_token}",
-        "Content-Type": "application/json"
-    }
-
-    r = requests.get(
-        f"{base_url}/rest/api/content/{page_id}?expand=version",
-        headers=headers
-    )
-
-    r.raise_for_status()
-    page_data = r.json()
-    current_version = page_data["version"]["number"]
 
     # Build new body (storage format)
     new_body = """
     <p>Hello from Python - updated version 39</p>
     """
 
-    # Update payload
-    update_data = {
-        "id": page_id,
-        "type": "page",
-        "title": page_data["title"],  # must include title unchanged (unless renaming)
-        "version": {"number": current_version + 1},
-        "body": {
-            "storage": {
-                "value": new_body,
-                "representation": "storage"
-            }
-        }
-    }
+    update_confluence_page_with_arbitrary_content(page_id, new_body)
 
-    # Send update request
-    update_response = requests.put(
-        f"{base_url}/rest/api/content/{page_id}",
-        headers=headers,
-        json=update_data
-    )
-    update_response.raise_for_status()
+def update_confluence_page_with_arbitrary_content(
+    page_id: str, new_body: str, page: Page = None):
+    """
+    Replace the content of a page.
 
-    print("Page updated successfully:", update_response.json()["title"])    
+    :param page: The page as returned by retrieve_page. If given, the update is sent right away
+                 instead of reading the current version first (PageConflictError is raised if the
+                 page has been changed since - use edit_confluence_page to change the content)
+    """
+    if page is None:
+        page = client.read_page(page_id, with_body=False)
 
-def update_confluence_page_with_arbitrary_content(
-    page_id: str, new_body: str):
-    
-    headers = {
-        "Authorization": f"Bearer {personal_access_token}",
-        "Content-Type": "application/json"
-    }
-
-    r = requests.get(
-        f"{base_url}/rest/api/content/{page_id}?expand=version",
-        headers=headers
-    )
+    updated_page = client.update_page(page, new_body, pushed_hashes=pushed_hashes)
 
-    r.raise_for_status()
-    page_data = r.json()
-    current_version = page_data["version"]["number"]
-
-    # Update payload
-    update_data = {
-        "id": page_id,
-        "type": "page",
-        "title": page_data["title"],  # must include title unchanged (unless renaming)
-        "version": {"number": current_version + 1},
-        "body": {
-            "storage": {
-                "value": new_body,
-                "representation": "storage"
-            }
-        }
-    }
+    if updated_page.version == page.version:
+        print("Page unchanged - not updated:", updated_page.title)
+    else:
+        print("Page updated successfully:", updated_page.title)
 
-    # Send update request
-    update_response = requests.put(
-        f"{base_url}/rest/api/content/{page_id}",
-        headers=headers,
-        json=update_data
-    )
-    update_response.raise_for_status()
+def edit_confluence_page(page_id: str, edit, page: Page = None):
+    """
+    Change the content of a page based on its current content.
 
-    print("Page updated successfully:", update_response.json()["title"])    
+    :param edit: Function taking the storage format of the page and returning the new one. If the page
+                 is changed by someone else in the meantime, the edit is applied to their version
+    :param page: The page as returned by retrieve_page - saves reading it again
+    """
+    page = page or client.read_page(page_id)
 
+    updated_page = client.edit_page(page_id, edit, page=page)
 
-def get_child_meta_data_for_child_pages(page_id: str):
+    if updated_page.version == page.version:
+        print("Page unchanged - not updated:", updated_page.title)
+    else:
+        print("Page updated successfully:", updated_page.title)
 
-    url = f"{base_url}/rest/api/content/{page_id}/child/page"
 
-    headers = {
-        "Authorization": f"Bearer {personal_access_token}",
-        "Content-Type": "application/json"
-    }
+def get_child_meta_data_for_child_pages(page_id: str):
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    data = response.json()
-    
+    # Follows the pagination - a single request only returns the first 25 children
     children = []
-    for child in data.get("results", []):
+    for child in client.iter_child_pages(page_id):
         children.append({
             "id": child["id"],
             "title": child["title"]
@@ -261,91 +176,70 @@ def get_child_meta_data_for_child_pages(page_id: str):
     
     return children
 
-def add_section_by_building_it_in_this_function(storage_format: str, header: str, paragraph: str) -> str:
-    soup = BeautifulSoup(storage_format, "html.parser")
+def get_meta_data_for_all_descendant_pages(page_id: str, max_workers: int = 8):
+    """
+    Yield id, title, version and ancestor ids of every page below the given page.
 
-    # Find the existing layout
-    layout = soup.find("ac:layout")
-    if not layout:
-        # If no layout exists, create one
-        layout = soup.new_tag("ac:layout")
-        soup.append(layout)
+    The pages are found with one CQL search, whose result pages are fetched concurrently.
+    """
+    for page_info in client.walk_page_tree(page_id, max_workers=max_workers):
+        yield {
+            "id": page_info.id,
+            "title": page_info.title,
+            "version": page_info.version,
+            "ancestors": list(page_info.ancestors)
+        }
 
+def add_section_by_building_it_in_this_function(storage_format: str, header: str, paragraph: str) -> str:
     # Build a new section
-    new_section = soup.new_tag("ac:layout-section")
-    new_section["ac:type"] = "single"
-
-    new_cell = soup.new_tag("ac:layout-cell")
-    h1 = soup.new_tag("h1")
-    h1.string = header
-    p = soup.new_tag("p")
-    p.string = paragraph
-
-    new_cell.append(h1)
-    new_cell.append(p)
-    new_section.append(new_cell)
+    builder = StorageBuilder()
+    with builder.section(), builder.cell():
+        builder.heading(header)
+        builder.paragraph(paragraph)
 
     # Append inside the layout
-    layout.append(new_section)
-
-    return str(soup)
-
-def add_section(storage_format: str, new_section: str) -> str:
-    soup = BeautifulSoup(storage_format, "html")
+    return add_section(storage_format, str(builder))
 
-    # Find or create the layout
-    layout = soup.find("ac:layout")
-    if not layout:
-        layout = soup.new_tag("ac:layout")
-        soup.append(layout)
-
-    # Parse the new section string into a tag
-    new_section = BeautifulSoup(new_section, "html").find("ac:layout-section")
+def gitlab_raw_file_url(path: str) -> str:
+    """
+    URL of the raw content of a file in the catalogs repository on GitLab - with a plain &, to be escaped by the builder.
+    """
+    return ("https://gitlab.dmi.dk/api/v4/projects/1392/repository/files/"
+            f"{quote(path, safe='')}/raw?ref=main&private_token={gitlab_access_token}")
 
-    if new_section:
-        layout.append(new_section)
-    else:
-        raise ValueError("Provided string does not contain a valid <ac:layout-section>")
+# The functions below parse and serialise the page once per call. For several
+# edits of the same page, use a StorageDocument directly instead.
 
-    return str(soup)
+def add_section(storage_format: str, new_section: str) -> str:
+    document = StorageDocument(storage_format)
+    document.add_section(new_section)
+    return str(document)
 
 def delete_section(storage_format: str,
                    header: str) -> str:
-    
-    soup = BeautifulSoup(storage_format, "html")
-
-    # Ensure layout exists
-    layout = soup.find("ac:layout")
-
-    # Collect all existing sections
-    sections = layout.find_all("ac:layout-section", recursive=False)
-
-    # Helper to extract first header text from a section
-    def get_header_text(section):
-        header = section.find(["h1", "h2", "h3", "h4", "h5", "h6"])
-        return header.get_text(strip=True) if header else None
-
-    index_of_section_to_delete = None
-    for i, sec in enumerate(sections):
-        if get_header_text(sec) == header:
-            index_of_section_to_delete = i
-            break
-
-    if index_of_section_to_delete is not None:
-        sections[index_of_section_to_delete].decompose()
-
-    return str(soup)
+    document = StorageDocument(storage_format)
+    document.delete_section(header)
+    return str(document)
 
 def update_section(storage_format: str,
                    header: str,
                    new_section: str) -> str:
-    
-    # Helper to extract first header text from a section
-    def get_header_text(section):
-        header = section.find(["h1", "h2", "h3", "h4", "h5", "h6"])
-        return header.get_text(strip=True) if header else None
+    """
+    Replace the section with the given header - the page is left unchanged if there is no such section.
+    """
+    document = StorageDocument(storage_format)
+    document.replace_section(header, new_section)
+    return str(document)
 
-    pass
+def upsert_section(storage_format: str,
+                   header: str,
+                   new_section: str) -> str:
+    """
+    Replace the section with the given header, or append the new section if there is no such section.
+    """
+    document = StorageDocument(storage_format)
+    document.upsert_section(header, new_section)
+    return str(document)
 
 def insert_section(storage_format: str,
                    new_section: str,
@@ -355,59 +249,32 @@ def insert_section(storage_format: str,
     Insert a new section into a Confluence storage format page.
 
     :param storage_format: Existing Confluence storage format string
-    :param new_section_str: New section XML string (<ac:layout-section>...</ac:layout-section>)
+    :param new_section: New section XML string (<ac:layout-section>...</ac:layout-section>)
     :param before_headers: List of header texts that should come before the new section
     :param after_headers: List of header texts that should come after the new section
     :return: Updated storage format string
     """
-    before_headers = before_headers or []
-    after_headers = after_headers or []
-
-    soup = BeautifulSoup(storage_format, "html")
-    layout = soup.find("ac:layout")
-
-    # Parse the new section string
-    new_section = BeautifulSoup(new_section, "html").find("ac:layout-section")
-    if not new_section:
-        raise ValueError("Provided string does not contain a valid <ac:layout-section>")
-
-    # Collect all existing sections
-    sections = layout.find_all("ac:layout-section", recursive=False)
-
-    # Helper to extract first header text from a section
-    def get_header_text(section):
-        header = section.find(["h1", "h2", "h3", "h4", "h5", "h6"])
-        return header.get_text(strip=True) if header else None
-
-    # Decide insert position
-    insert_index = len(sections)  # default to end
-    for i, sec in enumerate(sections):
-        header = get_header_text(sec)
-        if header:
-            if header in after_headers:
-                # Insert before the first "after" section
-                insert_index = i
-                break
-
-    # If none of the after_headers matched, but before_headers exist, 
-    # we ensure the new section comes after them
-    if before_headers:
-        for i, sec in enumerate(sections):
-            header = get_header_text(sec)
-            if header in before_headers:
-                insert_index = i + 1
-
-    # Insert at calculated position
-    if insert_index >= len(sections):
-        layout.append(new_section)
-    else:
-        sections[insert_index].insert_before(new_section)
+    document = StorageDocument(storage_format)
+    document.insert_section(new_section, before_headers, after_headers)
+    return str(document)
 
-    return str(soup)
+def reorder_sections(storage_format: str,
+                     preferred_headers: list[str]) -> str:
+    """
+    Sort the sections of a page according to a preferred order of their headers.
+
+    Sections with headers that aren't in preferred_headers keep their positions.
+    """
+    document = StorageDocument(storage_format)
+    document.reorder_sections(preferred_headers)
+    return str(document)
 
 
 if __name__ == "__main__":
     try:
+        page_cache = PageCache("page_cache.sqlite")
+        pushed_hashes = PushedHashes("pushed_hashes.sqlite")
+
         if False:
             retrieve_attachment_info_chatgpt()
 
@@ -447,22 +314,14 @@ if __name__ == "__main__":
         # Create a page with a macro linking to a GitLab file
         if False:
 
-            body = f"""
-            <ac:layout>
-              <ac:layout-section ac:type="single">
-                <ac:layout-cell>
-                  <h1>Hallo</h1>
-                  <h2>Hallo</h2>
-                  <h3>Hallo</h3>
-                  <p>Hallo</p>
-                  <ac:structured-macro ac:name="html-bobswift">
-                    <ac:parameter ac:name="script">#https://gitlab.dmi.dk/api/v4/projects/1392/repository/files/catalogs_generated%2Faci_mermaid_files%2FARNE.mmd/raw?ref=main&amp;private_token={gitlab_access_token}</ac:parameter>
-                    <ac:parameter ac:name="atlassian-macro-output-type">INLINE</ac:parameter>
-                  </ac:structured-macro>
-                </ac:layout-cell>
-              </ac:layout-section>
-            </ac:layout>
-            """
+            builder = StorageBuilder()
+            with builder.layout(), builder.section(), builder.cell():
+                builder.heading("Hallo", level=1)
+                builder.heading("Hallo", level=2)
+                builder.heading("Hallo", level=3)
+                builder.paragraph("Hallo")
+                builder.bobswift_macro(gitlab_raw_file_url("catalogs_generated/aci_mermaid_files/ARNE.mmd"))
+            body = str(builder)
 
             create_confluence_page(
                 space_key="~ebs",
@@ -486,35 +345,14 @@ if __name__ == "__main__":
                 "HALKA.mmd",
             ]
 
-            base = "https://gitlab.dmi.dk/api/v4/projects/1392/repository/files/catalogs_generated%2Faci_mermaid_files"
-
-            sections = []
-
-            for f in files:
-                # Encode filename for URL (spaces, slashes, etc.)
-                from urllib.parse import quote
-                
-                encoded_file = quote(f, safe="")
-                url = (
-                    f"#"  # hash required by BobSwift
-                    f"{base}%2F{encoded_file}/raw?ref=main&amp;private_token={gitlab_access_token}"
-                )
-
-                section = f"""
-                <ac:layout-section ac:type="single">
-                <ac:layout-cell>
-                    <p>Diagram: {f}</p>
-                    <ac:structured-macro ac:name="html-bobswift" ac:schema-version="1">
-                    <ac:parameter ac:name="script">{url}</ac:parameter>
-                    <ac:parameter ac:name="atlassian-macro-output-type">INLINE</ac:parameter>
-                    </ac:structured-macro>
-                </ac:layout-cell>
-                </ac:layout-section>
-                """
-                sections.append(section)
-
-                # Wrap everything in <ac:layout>
-                body = "<ac:layout>\n" + "\n".join(sections) + "\n</ac:layout>"
+            # The body is joined once at the end, so hundreds of sections are no problem
+            builder = StorageBuilder()
+            with builder.layout():
+                for f in files:
+                    with builder.section(), builder.cell():
+                        builder.paragraph(f"Diagram: {f}")
+                        builder.bobswift_macro(gitlab_raw_file_url(f"catalogs_generated/aci_mermaid_files/{f}"))
+            body = str(builder)
 
             create_confluence_page(
                 space_key="~ebs",
@@ -626,16 +464,16 @@ if __name__ == "__main__":
 
         # Append a new section to an existing page (1)
         if False:
-            content = retrieve_page_content(page_id="222556598")
-            new_content = add_section_by_building_it_in_this_function(content, "Vælling", "Vælling")
+            page = retrieve_page(page_id="222556598")
 
-            update_confluence_page_with_arbitrary_content(
+            edit_confluence_page(
                 page_id="222556598",
-                new_body=new_content)
+                edit=lambda content: add_section_by_building_it_in_this_function(content, "Vælling", "Vælling"),
+                page=page)
 
         # Append a new section to an existing page (2)
         if False:
-            content = retrieve_page_content(page_id="222556598")
+            page = retrieve_page(page_id="222556598")
 
             new_section = """
             <ac:layout-section ac:type="single">
@@ -646,15 +484,14 @@ if __name__ == "__main__":
             </ac:layout-section>
             """
 
-            new_content = add_section(content, new_section)
-
-            update_confluence_page_with_arbitrary_content(
+            edit_confluence_page(
                 page_id="222556598",
-                new_body=new_content)
+                edit=lambda content: add_section(content, new_section),
+                page=page)
 
         # INSERT a new section on an existing page (doesn't seem entirely reliable yet)
         if False:
-            content = retrieve_page_content(page_id="222556598")
+            page = retrieve_page(page_id="222556598")
 
             new_section = f"""
             <ac:layout-section ac:type="single">
@@ -669,15 +506,14 @@ if __name__ == "__main__":
             </ac:layout-section>
             """
 
-            new_content = insert_section(
-                content,
-                new_section,
-                ["Section 1", "Section 2", "Section 3", "Section 4"],
-                ["Section 6", "Section 7"])
-
-            update_confluence_page_with_arbitrary_content(
+            edit_confluence_page(
                 page_id="222556598",
-                new_body=new_content)
+                edit=lambda content: insert_section(
+                    content,
+                    new_section,
+                    ["Section 1", "Section 2", "Section 3", "Section 4"],
+                    ["Section 6", "Section 7"]),
+                page=page)
 
         # Retrieve metadata for child pages of given page
         if False:
@@ -686,17 +522,93 @@ if __name__ == "__main__":
             for meta_data in meta_data_list:
                 print(f"id: {meta_data['id']}, title: {meta_data['title']}")
 
+        # Retrieve metadata for all pages below a given page
+        if False:
+            for meta_data in get_meta_data_for_all_descendant_pages("222553283"):
+                print(f"id: {meta_data['id']}, title: {meta_data['title']}, depth: {len(meta_data['ancestors'])}")
+
+        # Add a section to a number of pages according to a whitelist (existing sections are replaced)
+        if False:
+            whitelist = ["222556598", "222553283"]
+
+            new_section = """
+            <ac:layout-section ac:type="single">
+            <ac:layout-cell>
+                <h1>Section 3</h1>
+                <p>Rolled out from Python</p>
+            </ac:layout-cell>
+            </ac:layout-section>
+            """
+
+            summary = rollout_section(
+                client,
+                new_section,
+                page_ids=whitelist,
+                before_headers=["Section 1", "Section 2"])
+
+            print(summary)
+            for page_id, error in summary.failed.items():
+                print(f"Failed: {page_id}: {error}")
+
+        # Sort the sections of a page according to a preferred order
+        if False:
+            page = retrieve_page(page_id="222556598")
+
+            edit_confluence_page(
+                page_id="222556598",
+                edit=lambda content: reorder_sections(content, ["Section 1", "Section 2", "Section 3", "Section 4"]),
+                page=page)
+
+        # Sort the sections of all pages below a given page according to a preferred order
+        if False:
+            summary = rollout_section_order(
+                client,
+                ["Section 1", "Section 2", "Section 3", "Section 4"],
+                cql="ancestor = 222553283 and type = page")
+
+            print(summary)
+            for page_id, error in summary.failed.items():
+                print(f"Failed: {page_id}: {error}")
+
+        # Download the attachments of all pages below a given page (and of the page itself)
+        if False:
+            page_ids = ["222553283"] + [meta_data["id"] for meta_data in get_meta_data_for_all_descendant_pages("222553283")]
+
+            for result in download_attachments(client, page_ids, "attachments"):
+                if isinstance(result, tuple):
+                    attachment, error = result
+                    print(f"Failed: {attachment['title']}: {error}")
+                else:
+                    print(f"Downloaded {result.path} ({result.size} bytes)")
+
+        # Read all pages below a given page, with their content, in bulk
+        if False:
+            for page in retrieve_pages(cql="ancestor = 222553283 and type = page"):
+                print(f"id: {page.id}, title: {page.title}, version: {page.version}, size: {len(page.body)}")
+
+        # Sync a folder of storage format files to child pages of a given page (only changed files are pushed)
+        if False:
+            summary = sync_folder(client, "pages", root_id="222553283")
+            print(summary)
+            for name in summary.conflicts:
+                print(f"Edited in Confluence since last sync - not pushed: {name}")
+
+        # Publish a folder of Markdown files as child pages of a given page (converted in parallel, memoised)
+        if False:
+            summary = publish_markdown_folder(client, "docs", root_id="222553283")
+            print(summary)
+
         # Delete an existing section from a page
         if False:
-            content = retrieve_page_content(page_id="222556598")
-            new_content = delete_section(content, "Section 4")
-            update_confluence_page_with_arbitrary_content(
+            page = retrieve_page(page_id="222556598")
+            edit_confluence_page(
                 page_id="222556598",
-                new_body=new_content)
+                edit=lambda content: delete_section(content, "Section 4"),
+                page=page)
             
         # Insert or replace (upsert) a section on an existing page
         if True:
-            content = retrieve_page_content(page_id="222556598")
+            page = retrieve_page(page_id="222556598")
 
             new_section = """
             <ac:layout-section ac:type="single">
@@ -707,17 +619,21 @@ if __name__ == "__main__":
             </ac:layout-section>
             """
 
-            new_content = upsert_section(
-                storage_format=content,
-                header="Section 4",
-                new_section=new_section)
-
-            update_confluence_page_with_arbitrary_content(
+            edit_confluence_page(
                 page_id="222556598",
-                new_body=new_content)
+                edit=lambda content: upsert_section(
+                    storage_format=content,
+                    header="Section 4",
+                    new_section=new_section),
+                page=page)
 
 
     except Exception as e:
         print("Error:", e)
         sys.exit(1)
+    finally:
+        if page_cache is not None:
+            page_cache.close()
+        if pushed_hashes is not None:
+            pushed_hashes.close()
 
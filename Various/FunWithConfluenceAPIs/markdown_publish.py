@@ -0,0 +1,164 @@
+"""
+Conversion of folders of Markdown files to storage format, for publishing.
+
+The files are converted in a pool of processes, so a large folder uses all
+cores. Each worker creates its Markdown converter once and resets it between
+files, instead of paying for the setup (extensions, patterns) per file.
+
+Conversions are remembered by the hash of the Markdown (and the converter
+settings), so only new or changed files are converted again - and identical
+files only once.
+"""
+
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import markdown  # pip install markdown
+except ImportError:
+    markdown = None
+
+from confluence_client import ConfluenceClient
+from space_sync import SyncSummary, sync_folder
+
+DEFAULT_EXTENSIONS = ("tables", "fenced_code")
+
+# Below this many files, starting worker processes costs more than it saves
+MIN_FILES_FOR_POOL = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversions (
+    hash TEXT PRIMARY KEY,
+    storage TEXT NOT NULL
+);
+"""
+
+# The converter of a worker process (or of this process, when converting without a pool)
+_converter = None
+_converter_extensions = None
+
+
+def _create_converter(extensions: tuple[str, ...]):
+    global _converter, _converter_extensions
+    # Storage format is XHTML, so e.g. <br /> rather than <br>
+    _converter = markdown.Markdown(extensions=list(extensions), output_format="xhtml")
+    _converter_extensions = extensions
+
+
+def _convert(text: str) -> str:
+    _converter.reset()
+    return _converter.convert(text)
+
+
+def _source_hash(source: bytes, extensions: tuple[str, ...]) -> str:
+    # A different converter gives a different result for the same Markdown
+    settings = f"{markdown.__version__};{','.join(extensions)}\0".encode("utf-8")
+    return hashlib.sha256(settings + source).hexdigest()
+
+
+class ConversionCache:
+    """
+    Storage format of converted Markdown, by the hash of the Markdown.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        :param db_path: SQLite file - created if it doesn't exist
+        """
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get_many(self, hashes: list[str]) -> dict[str, str]:
+        """
+        :return: Hash -> storage format, for the hashes that are in the cache
+        """
+        found = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            found.update(self.connection.execute(
+                f"SELECT hash, storage FROM conversions WHERE hash IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def put_many(self, conversions: dict[str, str]):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO conversions VALUES (?, ?)", conversions.items())
+
+
+def convert_markdown_files(paths: list[str], cache: ConversionCache = None, max_workers: int = None,
+                           extensions: tuple[str, ...] = DEFAULT_EXTENSIONS) -> dict:
+    """
+    Convert Markdown files to storage format.
+
+    :param cache: Conversions to reuse, and to add the new ones to
+    :param max_workers: Number of worker processes - defaults to the number of CPUs
+    :param extensions: Extensions of python-markdown to convert with
+    :return: Path -> storage format, or the exception if the file couldn't be read
+    """
+    if markdown is None:
+        raise ImportError("Converting Markdown requires markdown (pip install markdown)")
+
+    results = {}
+    sources = {}  # Hash -> Markdown
+    path_hashes = {}
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                source = f.read()
+            text = source.decode("utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            results[path] = e
+            continue
+        path_hashes[path] = _source_hash(source, extensions)
+        sources[path_hashes[path]] = text
+
+    converted = cache.get_many(list(sources)) if cache is not None else {}
+    missing = [source_hash for source_hash in sources if source_hash not in converted]
+    texts = [sources[source_hash] for source_hash in missing]
+    if len(missing) < MIN_FILES_FOR_POOL:
+        if _converter_extensions != extensions:
+            _create_converter(extensions)
+        new = [_convert(text) for text in texts]
+    else:
+        max_workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_create_converter,
+                                 initargs=(extensions,)) as executor:
+            # Files are small, so hand them out in batches rather than one by one
+            new = list(executor.map(_convert, texts, chunksize=max(1, len(texts) // (4 * max_workers))))
+    new = dict(zip(missing, new))
+    if cache is not None and new:
+        cache.put_many(new)
+    converted.update(new)
+
+    for path, source_hash in path_hashes.items():
+        results[path] = converted[source_hash]
+    return results
+
+
+def publish_markdown_folder(client: ConfluenceClient, folder: str, root_id: str, cache_path: str = None,
+                            max_workers: int = None, overwrite: bool = False) -> SyncSummary:
+    """
+    Publish the Markdown files of a folder as child pages of root_id - see sync_folder.
+
+    :param cache_path: SQLite file of the conversion cache - defaults to one in the folder
+    :param max_workers: Number of conversion processes
+    """
+    if cache_path is None:
+        cache_path = os.path.join(folder, ".markdown_conversions.db")
+    with ConversionCache(cache_path) as cache:
+        def convert_many(paths):
+            return convert_markdown_files(paths, cache=cache, max_workers=max_workers)
+
+        return sync_folder(client, folder, root_id, convert_many=convert_many, extensions=(".md",),
+                           overwrite=overwrite)
@@ -0,0 +1,89 @@
+"""
+Disk cache of Confluence page bodies.
+
+Bodies are stored per page id together with the version they belong to. A
+cached body is only used after a cheap metadata request has confirmed that
+the page is still at that version. The cache is capped in size - when it
+grows beyond the cap, the least recently used pages are evicted.
+"""
+
+import sqlite3
+import threading
+import time
+
+from confluence_client import Page
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used);
+"""
+
+
+class PageCache:
+
+    def __init__(self, db_path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param db_path: SQLite file - created if it doesn't exist
+        :param max_bytes: Size cap on the cached bodies (UTF-8 encoded)
+        """
+        # The client may be called from worker threads - every use of the
+        # connection is guarded by the lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.executescript(_SCHEMA)
+        self.max_bytes = max_bytes
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get(self, page_id: str, version: int) -> Page:
+        """
+        :return: The cached page if it is at the given version, otherwise None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT title, body FROM pages WHERE page_id = ? AND version = ?", (page_id, version)).fetchone()
+            if row is None:
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE pages SET last_used = ? WHERE page_id = ?", (time.time(), page_id))
+        return Page(id=page_id, title=row[0], version=version, body=row[1])
+
+    def put(self, page: Page):
+        size = len(page.body.encode("utf-8"))
+        with self.lock, self.connection:
+            old = self.connection.execute("SELECT size FROM pages WHERE page_id = ?", (page.id,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (page.id, page.version, page.title, page.body, size, time.time()))
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used pages until the cache is below 90% of the
+        # cap, so we don't evict on every single put once the cache is full
+        target = self.max_bytes * 0.9
+        rows = self.connection.execute("SELECT page_id, size FROM pages ORDER BY last_used")
+        evicted = []
+        for page_id, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((page_id,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM pages WHERE page_id = ?", evicted)
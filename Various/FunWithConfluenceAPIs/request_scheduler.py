@@ -0,0 +1,193 @@
+"""
+Scheduling of the requests to a server that throttles its clients.
+
+Every request waits for a token from a token bucket and for a free slot
+among the connections to its host. When the server answers 429 or 503 the
+request is retried - after Retry-After if the server says how long to wait,
+otherwise after a jittered exponential backoff - and the whole bucket is
+paused and slowed down, so the other threads back off too instead of
+collecting 429s of their own. While requests succeed the rate creeps back
+up to the configured one. Throughput thus settles just below the server's
+limit.
+
+A 503 (e.g. from a proxy) may come after the server has done what was
+asked, so a POST is only retried on 503 if the server says when to retry.
+
+The same scheduler works for threads (send) and asyncio (send_async).
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Statuses the server answers when it throttles us
+RETRY_STATUSES = (429, 503)
+
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Methods that can be sent again without doing twice what was asked
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, and bursts of up to burst requests.
+
+    The rate is cut by a third when the server throttles us (down to
+    min_rate), and grows back towards max_rate while it doesn't.
+    """
+
+    def __init__(self, rate: float, burst: int = None, min_rate: float = 0.5, max_rate: float = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate / 5))
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.throttled_at = float("-inf")
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token.
+
+        :return: Seconds to wait before the token may be used
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative - the deficit is the queue of waiting requests
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.paused_until - now)
+
+    def throttled(self, pause: float):
+        """
+        The server throttled us - slow down, and let nobody through for pause seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            # Requests in flight are throttled together - count them as one signal
+            if now - self.throttled_at >= 1:
+                self.rate = max(self.min_rate, self.rate * 2 / 3)
+                self.throttled_at = now
+            self.paused_until = max(self.paused_until, now + pause)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                # Additive increase - a tenth of max_rate more per second of successes
+                self.rate = min(self.max_rate, self.rate + self.max_rate / (10 * self.rate))
+
+
+def retry_after(response) -> float:
+    """
+    :return: Seconds to wait according to the Retry-After header of the response, or None if it has none
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+
+    def __init__(self, rate: float = 20, burst: int = None, max_per_host: int = 10, max_retries: int = 6,
+                 backoff_base: float = 0.5, backoff_cap: float = 60):
+        """
+        :param rate: Requests per second - the most the server allows, if it is known
+        :param burst: Requests that may be sent at once after an idle period - defaults to rate / 5
+        :param max_per_host: Maximum number of requests in flight to the same host
+        :param max_retries: Retries of a throttled request before its response is returned as it is
+        :param backoff_base: Seconds to wait after the first throttled attempt (before jitter), doubled per attempt
+        :param backoff_cap: Maximum seconds to wait between two attempts
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.async_host_slots = {}
+
+    def delay(self, response, attempt: int) -> float:
+        """
+        :return: Seconds to wait before retrying a throttled request
+        """
+        seconds = retry_after(response)
+        if seconds is None:
+            # Full jitter, so the throttled requests don't all come back at the same moment
+            seconds = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        return min(seconds, self.backoff_cap)
+
+    @staticmethod
+    def retryable(response, method: str) -> bool:
+        """
+        :return: True if a throttled request may be sent again - a 429 means it wasn't processed
+        """
+        return (response.status_code == HTTP_TOO_MANY_REQUESTS or method.upper() in IDEMPOTENT_METHODS
+                or retry_after(response) is not None)
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        host = urlsplit(url).netloc
+        with self.lock:
+            slots = self.host_slots.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+        with slots:
+            yield
+
+    def send(self, send, url: str, method: str = "GET"):
+        """
+        Send a request, when the rate and the host's connections allow it, and retry it while it is throttled.
+
+        :param send: Function sending the request and returning the response (requests or httpx)
+        :param url: The url of the request - only the host is used
+        :param method: The method of the request - decides whether a 503 is retried (see retryable)
+        :return: The response - which is still a 429/503 if the request was throttled max_retries times,
+                 or couldn't safely be retried
+        """
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.bucket.reserve())
+            with self._host_slot(url):
+                response = send()
+            if response.status_code not in RETRY_STATUSES:
+                self.bucket.succeeded()
+                return response
+            if attempt == self.max_retries or not self.retryable(response, method):
+                return response
+            delay = self.delay(response, attempt)
+            self.bucket.throttled(delay)
+            time.sleep(delay)
+
+    async def send_async(self, send, url: str, method: str = "GET"):
+        """
+        asyncio variant of send - send is a function returning an awaitable response.
+        """
+        host = urlsplit(url).netloc
+        slots = self.async_host_slots.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.bucket.reserve())
+            async with slots:
+                response = await send()
+            if response.status_code not in RETRY_STATUSES:
+                self.bucket.succeeded()
+                return response
+            if attempt == self.max_retries or not self.retryable(response, method):
+                return response
+            delay = self.delay(response, attempt)
+            self.bucket.throttled(delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,263 @@
+"""
+Roll a section out to many Confluence pages, e.g. the pages of a whitelist -
+or put the sections of many pages into a preferred order.
+
+Pages are fetched concurrently, each page is edited in a pool of worker
+processes (scanning large page bodies is CPU-bound), and the
+updated pages are pushed with a bounded number of concurrent requests (and
+the client's request scheduler keeps within the server's rate limit). The
+three stages overlap, so pushing starts as soon as the first pages are
+edited. Pages the edit doesn't change (e.g. they already contain the
+section) are not touched, so running a rollout again only updates the pages
+that still differ.
+"""
+
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from confluence_client import ConfluenceClient, Page
+from storage_document import StorageDocument, parse_section
+from storage_hash import same_storage
+
+
+@dataclass
+class RolloutSummary:
+    updated: list[str] = field(default_factory=list)  # Ids of the pages that were changed
+    unchanged: list[str] = field(default_factory=list)  # Ids of the pages that were as they should be already
+    failed: dict[str, str] = field(default_factory=dict)  # Page id -> error
+    seconds: float = 0
+
+    def __str__(self):
+        done = len(self.updated) + len(self.unchanged) + len(self.failed)
+        return (f"{done} pages - {len(self.updated)} updated, {len(self.unchanged)} unchanged, "
+                f"{len(self.failed)} failed ({self.seconds:.1f} s)")
+
+
+def apply_section(storage_format: str, new_section: str,
+                  before_headers: list[str] = None, after_headers: list[str] = None) -> str:
+    """
+    Put a section into a page - the existing section with the same header is
+    replaced, otherwise the section is inserted according to before_headers
+    and after_headers (see StorageDocument.insert_section).
+
+    :return: The new storage format, or None if the page already has the section (see storage_hash)
+    :raises ValueError: If the section has no header - it couldn't be found again, so it would be
+                        inserted once more on every rollout
+    """
+    section = parse_section(new_section)
+    if section.header is None:
+        raise ValueError("The section has no header")
+    document = StorageDocument(storage_format)
+    existing = document.get_section(section.header)
+    if existing is None:
+        document.insert_section(section, before_headers, after_headers)
+    elif same_storage(existing, section.text):
+        return None
+    else:
+        document.replace_section(section.header, section)
+    return str(document)
+
+
+def order_sections(storage_format: str, preferred_headers: list[str]) -> str | None:
+    """
+    Put the sections of a page into the preferred order (see StorageDocument.reorder_sections).
+
+    :return: The new storage format, or None if the sections are in that order already
+    """
+    document = StorageDocument(storage_format)
+    if not document.reorder_sections(preferred_headers):
+        return None
+    return str(document)
+
+
+def _push(client: ConfluenceClient, page: Page, new_body: str, edit, edit_args: tuple) -> bool:
+    """
+    Update a page (the client retries when the server throttles us, see ConfluenceClient.edit_page
+    for changes by someone else).
+
+    :return: False if the edit turned out to be made already (after someone else changed the page)
+    """
+    bodies = []  # The bodies the edit was applied to
+
+    def reapply(body):
+        bodies.append(body)
+        if len(bodies) == 1:
+            # Edited in a worker process already
+            return new_body
+        # Changed since we read it - edit the current version instead (rare, so done in this thread)
+        edited = edit(body, *edit_args)
+        return body if edited is None else edited
+
+    updated = client.edit_page(page.id, reapply, page=page)
+    # edit_page returns the page as it was read if the edit didn't change it
+    return updated.body is not bodies[-1]
+
+
+def _read_page(client: ConfluenceClient, page_id: str):
+    """
+    :return: The page, or its id and the error if it couldn't be read
+    """
+    try:
+        return client.read_page(page_id)
+    except Exception as e:
+        return page_id, e
+
+
+def _read_pages(client: ConfluenceClient, page_ids: list[str], executor: ThreadPoolExecutor, window: int):
+    # Like executor.map, but without reading all pages into memory up front
+    futures = deque()
+    for page_id in page_ids:
+        futures.append(executor.submit(_read_page, client, page_id))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def rollout_edit(client: ConfluenceClient,
+                 edit,
+                 edit_args: tuple,
+                 page_ids: list[str] = None,
+                 cql: str = None,
+                 fetch_workers: int = 8,
+                 edit_workers: int = None,
+                 push_workers: int = 4,
+                 progress_every: int = 50) -> RolloutSummary:
+    """
+    Edit every page of a list of page ids or of a CQL search.
+
+    :param edit: Function taking the storage format of a page and edit_args, and returning the new
+                 storage format, or None if the page is to be left as it is - it must be defined at
+                 module level, as it is run in worker processes
+    :param page_ids: E.g. a whitelist
+    :param cql: Alternative to page_ids, e.g. 'space = ESP and label = "whitelist"' or 'ancestor = 123'
+    :param edit_workers: Number of worker processes - defaults to the number of CPUs
+    :param push_workers: Maximum number of updates in flight
+    :param progress_every: Print progress to stderr every this many pages (0 to disable)
+    """
+    if (page_ids is None) == (cql is None):
+        raise ValueError("Give either page_ids or cql")
+
+    summary = RolloutSummary()
+    if cql is not None:
+        # Edited pages may move in the search results while they are paged through,
+        # so the ids are collected before any page is edited
+        page_ids = [result["id"] for result in client.search(cql)]
+    start = time.perf_counter()
+    total = len(page_ids)
+
+    def report(force=False):
+        summary.seconds = time.perf_counter() - start
+        done = len(summary.updated) + len(summary.unchanged) + len(summary.failed)
+        if progress_every and (force or done % progress_every == 0):
+            print(f"[{done}/{total}] {summary}", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=edit_workers) as edit_pool, \
+            ThreadPoolExecutor(max_workers=push_workers) as push_pool:
+
+        # Keep a bounded number of pages in memory
+        window = 4 * (fetch_workers + push_workers + (edit_workers or os.cpu_count() or 1))
+
+        if cql is None:
+            pages = _read_pages(client, page_ids, fetch_pool, 2 * fetch_workers)
+        else:
+            # Pages that are deleted in the meantime are left out
+            pages = client.read_pages(page_ids, max_workers=fetch_workers)
+        edits = {}
+        pushes = {}
+
+        def handle(done):
+            for future in done:
+                if future in edits:
+                    page = edits.pop(future)
+                    try:
+                        new_body = future.result()
+                    except Exception as e:
+                        # E.g. a page body that isn't well-formed - the other pages go on
+                        summary.failed[page.id] = str(e)
+                        report()
+                        continue
+                    if new_body is None:
+                        summary.unchanged.append(page.id)
+                        report()
+                    else:
+                        pushes[push_pool.submit(_push, client, page, new_body, edit, edit_args)] = page
+                else:
+                    page = pushes.pop(future)
+                    try:
+                        if future.result():
+                            summary.updated.append(page.id)
+                        else:
+                            summary.unchanged.append(page.id)
+                    except Exception as e:
+                        summary.failed[page.id] = str(e)
+                    report()
+
+        read_ids = set()
+        for page in pages:
+            if isinstance(page, tuple):
+                page_id, error = page
+                summary.failed[page_id] = str(error)
+                report()
+                continue
+            read_ids.add(page.id)
+            edits[edit_pool.submit(edit, page.body, *edit_args)] = page
+            while len(edits) + len(pushes) >= window:
+                done, _ = wait(list(edits) + list(pushes), return_when=FIRST_COMPLETED)
+                handle(done)
+
+        while edits or pushes:
+            done, _ = wait(list(edits) + list(pushes), return_when=FIRST_COMPLETED)
+            handle(done)
+
+    if cql is not None:
+        for page_id in page_ids:
+            if page_id not in read_ids:
+                summary.failed[page_id] = "Not found - deleted since the search?"
+
+    report(force=True)
+    return summary
+
+
+def rollout_section(client: ConfluenceClient,
+                    new_section: str,
+                    page_ids: list[str] = None,
+                    cql: str = None,
+                    before_headers: list[str] = None,
+                    after_headers: list[str] = None,
+                    **options) -> RolloutSummary:
+    """
+    Put a section into every page of a list of page ids or of a CQL search.
+
+    :param new_section: <ac:layout-section>...</ac:layout-section> - replaces the section with the same header,
+                        so it must have one
+    :param page_ids: The whitelist
+    :param cql: Alternative to page_ids, e.g. 'space = ESP and label = "whitelist"'
+    :param options: fetch_workers, edit_workers, push_workers and progress_every - see rollout_edit
+    """
+    # Fails here rather than in every worker
+    section = parse_section(new_section)
+    if section.header is None:
+        raise ValueError("The section has no header - it would be inserted again on every rollout")
+    edit_args = (section.text, before_headers, after_headers)
+    return rollout_edit(client, apply_section, edit_args, page_ids=page_ids, cql=cql, **options)
+
+
+def rollout_section_order(client: ConfluenceClient,
+                          preferred_headers: list[str],
+                          page_ids: list[str] = None,
+                          cql: str = None,
+                          **options) -> RolloutSummary:
+    """
+    Put the sections of every page of a list of page ids or of a CQL search into the preferred order.
+
+    :param preferred_headers: Header texts in the wanted order - sections with other headers stay where they are
+    :param cql: Alternative to page_ids, e.g. 'ancestor = 123 and type = page' for a page tree
+    :param options: fetch_workers, edit_workers, push_workers and progress_every - see rollout_edit
+    """
+    return rollout_edit(client, order_sections, (list(preferred_headers),), page_ids=page_ids, cql=cql, **options)
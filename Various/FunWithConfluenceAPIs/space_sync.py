@@ -0,0 +1,267 @@
+"""
+Incremental sync of a folder of files to the pages below a Confluence page.
+
+Every file becomes a child page of the root page, titled after the file
+name. A manifest next to the files remembers, per file, the page it was
+pushed to, the version that push created and the hash of what was pushed,
+and, per page below the root, its title and current version.
+
+A sync asks the server only for the pages modified since the previous sync
+(a CQL lastmodified search - one request when nothing has changed), and
+only pushes the files whose content changed. Files are only read again
+when their size or modification time changed. A page that was edited in
+Confluence since it was last pushed is reported as a conflict and left
+alone, unless overwrite is set. A page that was deleted in Confluence is
+created again, and a page of the same title that already exists below the
+root (e.g. created by a sync that was interrupted) is taken over.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import requests
+
+from confluence_client import ConfluenceClient, Page, PageConflictError
+from storage_hash import storage_hash
+
+MANIFEST_NAME = ".confluence_sync.json"
+
+# Format of dates in CQL
+CQL_DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+# CQL dates have minute resolution, and the search index may lag a little behind,
+# so the next sync looks a bit further back than the newest change seen
+WATERMARK_OVERLAP = 15 * 60
+
+HTTP_BAD_REQUEST = 400
+HTTP_NOT_FOUND = 404
+
+
+def read_storage_format(path: str) -> str:
+    """
+    Default conversion of a file to storage format - the file is storage format (XHTML) already.
+    """
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@dataclass
+class SyncSummary:
+    created: list[str] = field(default_factory=list)  # Paths of the files that got a new page
+    updated: list[str] = field(default_factory=list)
+    unchanged: list[str] = field(default_factory=list)
+    conflicts: list[str] = field(default_factory=list)  # Files whose page was edited in Confluence
+    failed: dict[str, str] = field(default_factory=dict)  # Path -> error
+    changed_pages: int = 0  # Pages reported modified by the server since the last sync
+
+    def __str__(self):
+        return (f"{len(self.created)} created, {len(self.updated)} updated, {len(self.unchanged)} unchanged, "
+                f"{len(self.conflicts)} conflicts, {len(self.failed)} failed "
+                f"({self.changed_pages} pages changed on the server)")
+
+
+class Manifest:
+
+    def __init__(self, path: str, load: bool = True):
+        """
+        :param load: Read the manifest from path, if it exists - otherwise start an empty one
+        """
+        self.path = path
+        data = {}
+        if load and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        self.root_id = data.get("root_id")
+        self.space_key = data.get("space_key")
+        self.watermark = data.get("watermark")  # CQL date of the newest change seen, minus the overlap
+        self.pages = data.get("pages", {})  # Page id -> {"title", "version"}
+        self.files = data.get("files", {})  # Path relative to the folder -> {"page_id", "version", "hash", "size", "mtime"}
+
+    def save(self):
+        # Write to a temporary file first, so an interrupted save doesn't lose the manifest
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "root_id": self.root_id,
+                "space_key": self.space_key,
+                "watermark": self.watermark,
+                "pages": self.pages,
+                "files": self.files,
+            }, f, indent=1)
+        os.replace(temporary_path, self.path)
+
+
+def _pull_changes(client: ConfluenceClient, manifest: Manifest) -> int:
+    cql = f"ancestor = {manifest.root_id} and type = page"
+    if manifest.watermark:
+        cql += f' and lastmodified > "{manifest.watermark}"'
+    count = 0
+    newest = None
+    for result in client.search(cql, expand="version"):
+        manifest.pages[result["id"]] = {"title": result["title"], "version": result["version"]["number"]}
+        count += 1
+        when = datetime.fromisoformat(result["version"]["when"])
+        if newest is None or when > newest:
+            newest = when
+    if newest is not None:
+        # The server's clock and time zone (the one "when" is given in), not ours, so an
+        # offset between the two doesn't make the next search skip changes
+        manifest.watermark = (newest - timedelta(seconds=WATERMARK_OVERLAP)).strftime(CQL_DATE_FORMAT)
+    return count
+
+
+def _find_page(client: ConfluenceClient, root_id: str, title: str) -> Page:
+    escaped = title.replace("\\", "\\\\").replace('"', '\\"')
+    cql = f'ancestor = {root_id} and type = page and title = "{escaped}"'
+    # The search may match case-insensitively
+    return next((page for page in client.search_pages(cql, max_workers=1) if page.title == title), None)
+
+
+def _push(client: ConfluenceClient, manifest: Manifest, title: str, storage_format: str, page_id: str,
+          overwrite: bool) -> Page:
+    if page_id is not None:
+        # The version is known from the manifest, so the page doesn't have to be read first.
+        # If the page was changed since, PageConflictError is raised, unless overwrite is set
+        page = Page(id=page_id, title=title, version=manifest.pages[page_id]["version"])
+        try:
+            return client.update_page(page, storage_format, overwrite=overwrite)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != HTTP_NOT_FOUND:
+                raise
+            # Deleted in Confluence - create it again
+
+    response = client.create_page({
+        "type": "page",
+        "title": title,
+        "space": {"key": manifest.space_key},
+        "ancestors": [{"id": manifest.root_id}],
+        "body": {"storage": {"value": storage_format, "representation": "storage"}}
+    })
+    if response.status_code == HTTP_BAD_REQUEST:
+        # Titles are unique per space - if the page is below the root, take it over
+        page = _find_page(client, manifest.root_id, title)
+        if page is not None:
+            return client.update_page(page, storage_format, overwrite=overwrite)
+    response.raise_for_status()
+    data = response.json()
+    return Page(id=data["id"], title=data["title"], version=data["version"]["number"], body=storage_format)
+
+
+def _convert_each(convert, paths: list[str]) -> dict:
+    converted = {}
+    for path in paths:
+        try:
+            converted[path] = convert(path)
+        except (OSError, ValueError) as e:
+            converted[path] = e
+    return converted
+
+
+def sync_folder(client: ConfluenceClient, folder: str, root_id: str, convert=read_storage_format,
+                extensions: tuple[str, ...] = (".html", ".xhtml"), overwrite: bool = False,
+                max_workers: int = 4, convert_many=None) -> SyncSummary:
+    """
+    Push the files of a folder to child pages of root_id, as far as they changed since the last sync.
+
+    :param convert: Function taking the path of a file and returning its storage format
+    :param extensions: The files to sync
+    :param overwrite: Push files whose page was edited in Confluence since the last push (losing that edit)
+    :param max_workers: Number of pages pushed at the same time
+    :param convert_many: Function taking a list of paths and returning a dict of path -> storage format (or the
+                         exception converting it) - used instead of convert, to convert the files in one batch
+    """
+    if convert_many is None:
+        def convert_many(paths):
+            return _convert_each(convert, paths)
+
+    manifest = Manifest(os.path.join(folder, MANIFEST_NAME))
+    if manifest.root_id != root_id:
+        # A new sync (or a different root) - start from scratch
+        manifest = Manifest(manifest.path, load=False)
+        manifest.root_id = root_id
+    if manifest.space_key is None:
+        manifest.space_key = client.get_page(root_id, expand="space")["space"]["key"]
+
+    summary = SyncSummary()
+    summary.changed_pages = _pull_changes(client, manifest)
+
+    files = {}  # Name -> (path, title, stat)
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        title, extension = os.path.splitext(name)
+        if extension.lower() in extensions and os.path.isfile(path):
+            files[name] = path, title, os.stat(path)
+
+    def remote_changed(entry):
+        page = manifest.pages.get(entry["page_id"]) if entry else None
+        return page is not None and page["version"] != entry["version"]
+
+    # Only files that changed on disk have to be converted - and those whose page is to be overwritten
+    to_convert = []
+    for name, (path, title, stat) in files.items():
+        entry = manifest.files.get(name)
+        if (not entry or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime
+                or (overwrite and remote_changed(entry))):
+            to_convert.append(path)
+    converted = convert_many(to_convert) if to_convert else {}
+
+    to_push = {}  # Path -> (title, storage format, hash, stat)
+    for name, (path, title, stat) in files.items():
+        entry = manifest.files.get(name)
+        if path in converted:
+            storage_format = converted[path]
+            if isinstance(storage_format, Exception):
+                summary.failed[name] = str(storage_format)
+                continue
+            content_hash = storage_hash(storage_format)
+        else:
+            storage_format, content_hash = None, entry["hash"]
+
+        if entry and content_hash == entry["hash"] and not remote_changed(entry):
+            # Only the modification time changed (or nothing)
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            summary.unchanged.append(name)
+            continue
+        if remote_changed(entry) and not overwrite:
+            summary.conflicts.append(name)
+            continue
+        to_push[name] = (title, storage_format, content_hash, stat)
+
+    # Saved whatever happens, so the pages created so far are known to the next sync
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for name, (title, storage_format, content_hash, stat) in to_push.items():
+                entry = manifest.files.get(name)
+                # A file without a known page gets a new one
+                page_id = entry["page_id"] if entry and entry["page_id"] in manifest.pages else None
+                futures[name] = page_id, executor.submit(_push, client, manifest, title, storage_format, page_id,
+                                                         overwrite)
+
+            for name, (page_id, future) in futures.items():
+                title, storage_format, content_hash, stat = to_push[name]
+                try:
+                    page = future.result()
+                except PageConflictError:
+                    # Edited in Confluence after the changes were pulled
+                    summary.conflicts.append(name)
+                    continue
+                except Exception as e:
+                    # E.g. an HTTP error, or a response without the expected fields
+                    summary.failed[name] = str(e)
+                    continue
+                if page.id != page_id:
+                    # A new page - or another one for a page that was deleted in Confluence
+                    manifest.pages.pop(page_id, None)
+                    summary.created.append(name)
+                else:
+                    summary.updated.append(name)
+                manifest.pages[page.id] = {"title": page.title, "version": page.version}
+                manifest.files[name] = {"page_id": page.id, "version": page.version, "hash": content_hash,
+                                        "size": stat.st_size, "mtime": stat.st_mtime}
+    finally:
+        manifest.save()
+    return summary
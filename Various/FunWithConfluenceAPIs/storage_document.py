@@ -0,0 +1,366 @@
+"""
+Section-level editing of Confluence storage format.
+
+A StorageDocument scans the page body once and keeps an index from header
+text to <ac:layout-section>, so any number of edits can be made before the
+page is serialised again - once.
+
+The page is not turned into a tree. A streaming scan (expat) only records
+where each section of the layout starts and ends, and the header text of the
+section. Serialising splices the original text back together, so everything
+outside the edited sections stays byte-identical - attribute quoting,
+entities, CDATA and whitespace included.
+"""
+
+import html.entities
+import xml.parsers.expat
+from dataclasses import dataclass
+
+HEADER_TAGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+
+LAYOUT_TAG = "ac:layout"
+SECTION_TAG = "ac:layout-section"
+
+# Storage format is a fragment, so it is scanned inside a wrapper element.
+# Confluence always writes the ac:/ri: prefixes, so elements are matched by
+# their qualified name, and the prefixes don't need to be declared.
+_WRAPPER_START = b"<storage>"
+_WRAPPER_END = b"</storage>"
+
+
+@dataclass(eq=False)
+class Section:
+    """
+    A <ac:layout-section> of a page. Sections are compared by identity.
+    """
+    header: str  # Text of the first header in the section - None if it has none
+    text: str  # The section as it is written in the page
+    gap: str = ""  # Text between the section and the next one (usually whitespace)
+
+
+def _end_of_start_tag(data: bytes, offset: int) -> int:
+    """
+    :return: Offset just after the start tag at offset - attribute values may contain '>'
+    """
+    quote = None
+    for i in range(offset, len(data)):
+        c = data[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in b"\"'":
+            quote = c
+        elif c == ord(">"):
+            return i + 1
+    raise ValueError("Unterminated start tag")
+
+
+class _Scan:
+    """
+    Byte offsets of the first layout and of the sections directly inside it.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.layout = None  # (start, end) of the <ac:layout> element
+        self.layout_content = None  # (start, end) of the content of the layout - None for <ac:layout/>
+        self.sections = []  # (start, end, header) of the sections directly inside the layout
+
+        self._depth = 0
+        self._layout_depth = None
+        self._section_start = None
+        self._header = None
+        self._header_depth = None
+        self._header_text = None
+
+        parser = xml.parsers.expat.ParserCreate("utf-8")
+        # Pretend there is an external DTD, so HTML entities like &nbsp; aren't errors
+        parser.UseForeignDTD(True)
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text
+        parser.SkippedEntityHandler = self._entity
+        self._parser = parser
+        try:
+            parser.Parse(_WRAPPER_START + data + _WRAPPER_END, True)
+        except xml.parsers.expat.ExpatError as e:
+            raise ValueError(f"Not valid storage format: {e}") from None
+
+    def _offset(self) -> int:
+        return self._parser.CurrentByteIndex - len(_WRAPPER_START)
+
+    def _element_end(self, start: int) -> int:
+        # Called from the end handler. For an empty element (<x/>) expat reports
+        # the offset just after it, otherwise the offset of the end tag
+        tag_end = _end_of_start_tag(self.data, start)
+        if self.data[tag_end - 2] == ord("/"):
+            return tag_end
+        return self.data.index(b">", self._offset()) + 1
+
+    def _start(self, name, attributes):
+        self._depth += 1
+        if self.layout is not None:
+            return
+        if self._layout_depth is None:
+            if name == LAYOUT_TAG:
+                self._layout_depth = self._depth
+                self._layout_start = self._offset()
+        elif self._depth == self._layout_depth + 1 and name == SECTION_TAG:
+            self._section_start = self._offset()
+            self._header = None
+        elif self._section_start is not None and self._header is None and name in HEADER_TAGS:
+            self._header_depth = self._depth
+            self._header_text = []
+
+    def _end(self, name):
+        if self._header_depth == self._depth:
+            self._header = "".join(self._header_text).strip()
+            self._header_depth = None
+        if self._layout_depth is not None and self.layout is None:
+            if self._depth == self._layout_depth + 1 and self._section_start is not None:
+                self.sections.append((self._section_start, self._element_end(self._section_start), self._header))
+                self._section_start = None
+            elif self._depth == self._layout_depth:
+                end = self._element_end(self._layout_start)
+                self.layout = (self._layout_start, end)
+                if self.data[end - 2] != ord("/"):
+                    self.layout_content = (_end_of_start_tag(self.data, self._layout_start), self._offset())
+        self._depth -= 1
+
+    def _text(self, data):
+        if self._header_depth is not None:
+            self._header_text.append(data)
+
+    def _entity(self, name, is_parameter_entity):
+        if self._header_depth is not None:
+            self._header_text.append(html.entities.html5.get(name + ";", ""))
+
+
+def parse_section(new_section) -> Section:
+    """
+    :param new_section: <ac:layout-section>...</ac:layout-section>, possibly surrounded by whitespace
+    """
+    if isinstance(new_section, Section):
+        return Section(new_section.header, new_section.text)
+    data = new_section.encode("utf-8")
+    scan = _Scan(b"<ac:layout>" + data + b"</ac:layout>")
+    if not scan.sections:
+        raise ValueError("Provided string does not contain a valid <ac:layout-section>")
+    start, end, header = scan.sections[0]
+    offset = len(b"<ac:layout>")
+    return Section(header, data[start - offset:end - offset].decode("utf-8"))
+
+
+class StorageDocument:
+
+    def __init__(self, storage_format: str):
+        data = storage_format.encode("utf-8")
+        scan = _Scan(data)
+
+        self.sections = []
+        if scan.layout_content is None:
+            # No layout, or an empty one - a layout is written in its place
+            # (or at the end of the page) when sections are added
+            layout_start, layout_end = scan.layout or (len(data), len(data))
+            self.head = data[:layout_start].decode("utf-8")
+            self.empty_layout = data[layout_start:layout_end].decode("utf-8")
+            self.tail = data[layout_end:].decode("utf-8")
+        else:
+            content_start, content_end = scan.layout_content
+            first = scan.sections[0][0] if scan.sections else content_end
+            self.head = data[:first].decode("utf-8")
+            self.empty_layout = None
+            for i, (start, end, header) in enumerate(scan.sections):
+                gap_end = scan.sections[i + 1][0] if i + 1 < len(scan.sections) else content_end
+                self.sections.append(Section(header, data[start:end].decode("utf-8"),
+                                             data[end:gap_end].decode("utf-8")))
+            self.tail = data[content_end:].decode("utf-8")
+
+        # Header text -> first section with that header
+        self.index = {}
+        for section in self.sections:
+            if section.header is not None:
+                self.index.setdefault(section.header, section)
+
+    def __str__(self):
+        parts = [self.head]
+        if self.empty_layout is not None:
+            if not self.sections:
+                return self.head + self.empty_layout + self.tail
+            parts.append(f"<{LAYOUT_TAG}>")
+        for section in self.sections:
+            parts.append(section.text)
+            parts.append(section.gap)
+        if self.empty_layout is not None:
+            parts.append(f"</{LAYOUT_TAG}>")
+        parts.append(self.tail)
+        return "".join(parts)
+
+    @staticmethod
+    def header_of(section: Section) -> str:
+        """
+        :return: Text of the first header in the section, or None if it has none
+        """
+        return section.header
+
+    def headers(self) -> list[str]:
+        return [section.header for section in self.sections]
+
+    def has_section(self, header: str) -> bool:
+        return header in self.index
+
+    def get_section(self, header: str) -> str:
+        """
+        :return: The first section with the given header as storage format, or None if there is none
+        """
+        section = self.index.get(header)
+        return section.text if section else None
+
+    def _register(self, section: Section, position: int):
+        self.sections.insert(position, section)
+        header = section.header
+        if header is not None and (header not in self.index or
+                                   self.sections.index(self.index[header]) > position):
+            self.index[header] = section
+
+    def _unregister(self, section: Section):
+        self.sections.remove(section)
+        header = section.header
+        if self.index.get(header) is section:
+            # Another section may have the same header
+            del self.index[header]
+            for other in self.sections:
+                if other.header == header:
+                    self.index[header] = other
+                    break
+
+    def _separator(self) -> str:
+        # Whitespace between the sections of this page, e.g. a newline and indentation
+        if len(self.sections) > 1 and self.sections[0].gap.isspace():
+            return self.sections[0].gap
+        return ""
+
+    def _place(self, section: Section, position: int):
+        separator = self._separator()
+        if position == len(self.sections) and self.sections:
+            # Keep the text between the last section and </ac:layout> at the end
+            last = self.sections[-1]
+            section.gap, last.gap = last.gap, separator
+        else:
+            section.gap = separator
+        self._register(section, position)
+
+    def add_section(self, new_section: str):
+        """
+        Append a section at the end of the layout.
+
+        :param new_section: <ac:layout-section>...</ac:layout-section>
+        """
+        self._place(parse_section(new_section), len(self.sections))
+
+    def insert_section(self, new_section: str, before_headers: list[str] = None, after_headers: list[str] = None):
+        """
+        Insert a section relative to other sections.
+
+        :param before_headers: Header texts of sections that should come before the new section
+        :param after_headers: Header texts of sections that should come after the new section
+        """
+        before_headers = set(before_headers or [])
+        after_headers = set(after_headers or [])
+        section = parse_section(new_section)
+
+        headers = self.headers()
+
+        # Insert before the first "after" section, default to the end
+        position = len(headers)
+        for i, header in enumerate(headers):
+            if header in after_headers:
+                position = i
+                break
+
+        # ...but after the last "before" section
+        for i, header in enumerate(headers):
+            if header in before_headers:
+                position = i + 1
+
+        self._place(section, position)
+
+    def delete_section(self, header: str) -> bool:
+        """
+        Delete the first section with the given header.
+
+        :return: True if a section was deleted
+        """
+        section = self.index.get(header)
+        if section is None:
+            return False
+        self._remove(section)
+        return True
+
+    def _remove(self, section: Section):
+        if section is self.sections[-1] and len(self.sections) > 1:
+            # Keep the text between the last section and </ac:layout> at the end
+            previous = self.sections[-2]
+            section.gap, previous.gap = previous.gap, section.gap
+        self._unregister(section)
+
+    def replace_section(self, header: str, new_section: str) -> bool:
+        """
+        Replace the first section with the given header, keeping its position.
+
+        :return: True if a section was replaced
+        """
+        old_section = self.index.get(header)
+        if old_section is None:
+            return False
+        section = parse_section(new_section)
+        section.gap = old_section.gap
+        position = self.sections.index(old_section)
+        self._unregister(old_section)
+        self._register(section, position)
+        return True
+
+    def upsert_section(self, header: str, new_section: str):
+        """
+        Replace the first section with the given header, or append the section if there is none.
+        """
+        if not self.replace_section(header, new_section):
+            self.add_section(new_section)
+
+    def move_section(self, header: str, position: int) -> bool:
+        """
+        Move the first section with the given header to the given position among the sections.
+
+        :return: True if a section was moved
+        """
+        section = self.index.get(header)
+        if section is None:
+            return False
+        self._remove(section)
+        self._place(section, min(position, len(self.sections)))
+        return True
+
+    def reorder_sections(self, preferred_headers: list[str]) -> bool:
+        """
+        Sort the sections whose header is in preferred_headers into that order.
+
+        The sort is stable, and the other sections keep their positions - the
+        sorted sections only trade places among themselves. Sections with the
+        same header keep their order.
+
+        :return: True if the order changed
+        """
+        rank = {header: i for i, header in enumerate(preferred_headers)}
+        positions = [i for i, section in enumerate(self.sections) if section.header in rank]
+        ranked = sorted((self.sections[i] for i in positions), key=lambda section: rank[section.header])
+        if all(self.sections[i] is section for i, section in zip(positions, ranked)):
+            return False
+        # The text between the sections belongs to the positions, not to the sections
+        gaps = [section.gap for section in self.sections]
+        for i, section in zip(positions, ranked):
+            self.sections[i] = section
+        for section, gap in zip(self.sections, gaps):
+            section.gap = gap
+        # The first section with each header is still the first, as the sort is stable
+        return True
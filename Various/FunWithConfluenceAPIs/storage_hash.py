@@ -0,0 +1,232 @@
+"""
+Canonical hashing of Confluence storage format.
+
+Two bodies get the same hash when they only differ in ways Confluence
+doesn't care about: the order and quoting of attributes, how characters are
+written (&nbsp; vs &#160; vs the character itself), the length of runs of
+whitespace, and whitespace next to the start or end of block-level elements
+(e.g. the indentation between sections). Whitespace next to inline elements
+is kept - "Hello <b>world</b>" is not "Hello<b>world</b>". The content of
+<pre> and of CDATA sections (e.g. the code in a code macro) is hashed as it
+is, since whitespace matters there.
+
+This is used to skip updates that wouldn't change a page - each of them
+would create a new page version, notify watchers and reindex the page.
+PushedHashes remembers the hash of what was last pushed to each page, so
+an unchanged body can be skipped without even downloading the page.
+"""
+
+import hashlib
+import html.entities
+import re
+import sqlite3
+import threading
+import xml.parsers.expat
+
+_ENTITY = re.compile(r"&([A-Za-z][A-Za-z0-9]*);")
+_CDATA = re.compile(r"(<!\[CDATA\[.*?\]\]>)", re.DOTALL)
+_XML_ENTITIES = frozenset(["amp", "lt", "gt", "quot", "apos"])
+_WHITESPACE = re.compile(r"[ \t\r\n]+")  # Not \s, which would also match &nbsp;
+
+# Elements whitespace next to the start or end of is only formatting
+BLOCK_TAGS = frozenset([
+    "storage", "p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dt", "dd",
+    "table", "thead", "tbody", "tfoot", "tr", "th", "td", "colgroup", "col", "blockquote", "pre", "hr", "br",
+    "ac:layout", "ac:layout-section", "ac:layout-cell", "ac:structured-macro", "ac:parameter",
+    "ac:rich-text-body", "ac:plain-text-body", "ac:task-list", "ac:task", "ac:task-id", "ac:task-status",
+    "ac:task-body",
+])
+
+
+def _character_reference(match) -> str:
+    # expat knows only the XML entities, and silently drops others in attribute values
+    name = match.group(1)
+    if name in _XML_ENTITIES:
+        return match.group(0)
+    text = html.entities.html5.get(name + ";")
+    if text is None:
+        return match.group(0)
+    return "".join(f"&#{ord(c)};" for c in text)
+
+
+def _character_references(storage_format: str) -> str:
+    # Not inside CDATA sections, where "&nbsp;" is just text
+    parts = _CDATA.split(storage_format)
+    for i in range(0, len(parts), 2):
+        parts[i] = _ENTITY.sub(_character_reference, parts[i])
+    return "".join(parts)
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+
+class _Canonicaliser:
+
+    def __init__(self, digest):
+        self.digest = digest
+        self.text = []
+        self.in_cdata = False
+        self.pre_depth = 0
+        self.after_block = True  # The text so far ends at the start or end of a block-level element
+
+        parser = xml.parsers.expat.ParserCreate("utf-8")
+        # Unknown entities are hashed by name rather than being errors
+        parser.UseForeignDTD(True)
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        parser.SkippedEntityHandler = self._entity
+        self.parser = parser
+
+    def feed(self, storage_format: str):
+        storage_format = _character_references(storage_format)
+        try:
+            self.parser.Parse(f"<storage>{storage_format}</storage>".encode("utf-8"), True)
+        except xml.parsers.expat.ExpatError as e:
+            raise ValueError(f"Not valid storage format: {e}") from None
+
+    def _write(self, text: str):
+        self.digest.update(text.encode("utf-8"))
+
+    def _flush_text(self, before_block: bool):
+        """
+        :param before_block: The text is followed by the start or end of a block-level element
+        """
+        if self.text:
+            text = "".join(self.text)
+            self.text = []
+            if not self.pre_depth:
+                text = _WHITESPACE.sub(" ", text)
+                if self.after_block:
+                    text = text.lstrip(" ")
+                if before_block:
+                    text = text.rstrip(" ")
+            if text:
+                self._write(_escape(text))
+        self.after_block = before_block
+
+    def _start(self, name, attributes):
+        self._flush_text(name in BLOCK_TAGS)
+        if name == "pre":
+            self.pre_depth += 1
+        self._write(f"<{name}")
+        for key in sorted(attributes):
+            self._write(f' {key}="{_escape(attributes[key])}"')
+        self._write(">")
+
+    def _end(self, name):
+        self._flush_text(name in BLOCK_TAGS)
+        if name == "pre":
+            self.pre_depth -= 1
+        self._write(f"</{name}>")
+
+    def _text(self, data):
+        if self.in_cdata:
+            self._write(data)
+        else:
+            self.text.append(data)
+
+    def _start_cdata(self):
+        self._flush_text(True)
+        self.in_cdata = True
+        self._write("<![CDATA[")
+
+    def _end_cdata(self):
+        self.in_cdata = False
+        self.after_block = True
+        self._write("]]>")
+
+    def _entity(self, name, is_parameter_entity):
+        self.text.append(f"&{name};")
+
+
+class _Collector:
+    # Looks like a hash object, but keeps what it is given
+
+    def __init__(self):
+        self.parts = []
+
+    def update(self, data: bytes):
+        self.parts.append(data)
+
+
+def canonical_storage(storage_format: str) -> str:
+    """
+    :return: The canonical form of the storage format that storage_hash hashes - mostly useful for debugging
+    """
+    collector = _Collector()
+    _Canonicaliser(collector).feed(storage_format)
+    return b"".join(collector.parts).decode("utf-8")
+
+
+def storage_hash(storage_format: str) -> str:
+    """
+    :return: SHA-256 (hex) of the canonical form of the storage format - or of
+             the text as it is, if it isn't well-formed (then it is up to the server)
+    """
+    digest = hashlib.sha256()
+    try:
+        _Canonicaliser(digest).feed(storage_format)
+    except ValueError:
+        digest = hashlib.sha256(b"\0" + storage_format.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def same_storage(a: str, b: str) -> bool:
+    """
+    :return: True if the two bodies only differ in ways that don't matter to Confluence
+    """
+    return a == b or storage_hash(a) == storage_hash(b)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pushed (
+    page_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+"""
+
+
+class PushedHashes:
+    """
+    The hash of the body last pushed to each page, and the version the push created.
+
+    If a page is still at that version, nobody has changed it since, so a new
+    body with the same hash doesn't have to be pushed.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        :param db_path: SQLite file - created if it doesn't exist
+        """
+        # Pages are pushed from several threads at a time
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, page_id: str, version: int) -> str:
+        """
+        :return: Hash of the body pushed to the page, if the page is still at the version that push created
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT hash FROM pushed WHERE page_id = ? AND version = ?", (page_id, version)).fetchone()
+        return row[0] if row else None
+
+    def put(self, page_id: str, version: int, hash: str):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO pushed VALUES (?, ?, ?)", (page_id, version, hash))
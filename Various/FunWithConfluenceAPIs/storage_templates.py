@@ -0,0 +1,202 @@
+"""
+Building of storage format from templates.
+
+A template is storage format with fields - {{ name }}, or {{ name|filter }}.
+It is compiled once (split into literal text and fields) and cached by its
+text, so rendering it again is a walk over the parts. Values are escaped
+unless the field says otherwise:
+
+    escape  - the default: text and attribute values (& < > " ')
+    raw     - storage format built elsewhere, e.g. a rendered section
+    cdata   - the plain text body of a macro, e.g. the code of a code macro
+
+Pages are assembled with a StorageBuilder, which collects the rendered parts
+in a list and only joins them at the end - so a page with hundreds of
+sections and macros takes time in proportion to its size, unlike a body
+that is concatenated again for every section added.
+
+    builder = StorageBuilder()
+    with builder.layout():
+        for name in files:
+            with builder.section(), builder.cell():
+                builder.paragraph(f"Diagram: {name}")
+                builder.bobswift_macro(url_of(name))
+    body = str(builder)
+"""
+
+import html
+import re
+from contextlib import contextmanager
+from functools import lru_cache
+
+_FIELD = re.compile(r"\{\{\s*(\w+)\s*(?:\|\s*(\w+)\s*)?\}\}")
+
+
+def escape(value) -> str:
+    """
+    Escape a value for use as text or as an attribute value.
+    """
+    return html.escape(str(value), quote=True)
+
+
+def cdata(value) -> str:
+    """
+    Wrap a value in a CDATA section - which can't contain "]]>", so that is split over two sections.
+    """
+    return "<![CDATA[" + str(value).replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+
+FILTERS = {
+    "escape": escape,
+    "raw": str,
+    "cdata": cdata,
+}
+
+
+class Template:
+    """
+    Storage format with {{ name|filter }} fields, split into its literal parts and fields once.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = []  # (literal text, field name or None, filter)
+        position = 0
+        for match in _FIELD.finditer(source):
+            name, filter_name = match.group(1), match.group(2) or "escape"
+            if filter_name not in FILTERS:
+                raise ValueError(f"Unknown filter in template: {match.group(0)}")
+            self.parts.append((source[position:match.start()], name, FILTERS[filter_name]))
+            position = match.end()
+        self.parts.append((source[position:], None, None))
+        self.fields = frozenset(name for _, name, _ in self.parts if name is not None)
+
+    def render_to(self, write, values: dict):
+        """
+        Write the rendered template piece by piece - e.g. to list.append or StringIO.write.
+        """
+        for literal, name, filter_function in self.parts:
+            if literal:
+                write(literal)
+            if name is not None:
+                try:
+                    value = values[name]
+                except KeyError:
+                    raise KeyError(f"No value for template field {name!r}") from None
+                write(filter_function(value))
+
+    def render(self, **values) -> str:
+        parts = []
+        self.render_to(parts.append, values)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> Template:
+    """
+    :return: The compiled template - compiled only the first time a template text is seen
+    """
+    return Template(source)
+
+
+LAYOUT_START = compile_template("<ac:layout>")
+LAYOUT_END = compile_template("</ac:layout>")
+SECTION_START = compile_template('<ac:layout-section ac:type="{{ type }}">')
+SECTION_END = compile_template("</ac:layout-section>")
+CELL_START = compile_template("<ac:layout-cell>")
+CELL_END = compile_template("</ac:layout-cell>")
+HEADING = compile_template("<h{{ level }}>{{ text }}</h{{ level }}>")
+PARAGRAPH = compile_template("<p>{{ text }}</p>")
+MACRO_START = compile_template('<ac:structured-macro ac:name="{{ name }}" ac:schema-version="{{ schema_version }}">')
+MACRO_END = compile_template("</ac:structured-macro>")
+MACRO_PARAMETER = compile_template('<ac:parameter ac:name="{{ name }}">{{ value }}</ac:parameter>')
+MACRO_PLAIN_TEXT_BODY = compile_template("<ac:plain-text-body>{{ body|cdata }}</ac:plain-text-body>")
+MACRO_RICH_TEXT_BODY = compile_template("<ac:rich-text-body>{{ body|raw }}</ac:rich-text-body>")
+
+
+class StorageBuilder:
+    """
+    Collects rendered storage format, to be joined once by str().
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def __str__(self):
+        return "".join(self.parts)
+
+    def render(self, template, **values):
+        """
+        Render a template - a Template, or the text of one - into the builder.
+        """
+        if isinstance(template, str):
+            template = compile_template(template)
+        template.render_to(self.write, values)
+
+    def raw(self, storage_format: str):
+        self.write(storage_format)
+
+    @contextmanager
+    def layout(self):
+        LAYOUT_START.render_to(self.write, {})
+        yield self
+        LAYOUT_END.render_to(self.write, {})
+
+    @contextmanager
+    def section(self, section_type: str = "single"):
+        """
+        :param section_type: single, two_equal, two_left_sidebar, two_right_sidebar, three_equal or three_with_sidebars
+        """
+        SECTION_START.render_to(self.write, {"type": section_type})
+        yield self
+        SECTION_END.render_to(self.write, {})
+
+    @contextmanager
+    def cell(self):
+        CELL_START.render_to(self.write, {})
+        yield self
+        CELL_END.render_to(self.write, {})
+
+    def heading(self, text: str, level: int = 1):
+        HEADING.render_to(self.write, {"level": level, "text": text})
+
+    def paragraph(self, text: str):
+        PARAGRAPH.render_to(self.write, {"text": text})
+
+    def macro(self, name: str, parameters: dict = None, plain_text_body: str = None, rich_text_body: str = None,
+              schema_version: str = "1"):
+        """
+        :param parameters: Parameter name -> value (escaped here - give e.g. URLs with & rather than &amp;)
+        :param plain_text_body: Text body, e.g. the code of a code macro
+        :param rich_text_body: Storage format body, e.g. the content of an expand macro
+        """
+        MACRO_START.render_to(self.write, {"name": name, "schema_version": schema_version})
+        for parameter_name, value in (parameters or {}).items():
+            MACRO_PARAMETER.render_to(self.write, {"name": parameter_name, "value": value})
+        if plain_text_body is not None:
+            MACRO_PLAIN_TEXT_BODY.render_to(self.write, {"body": plain_text_body})
+        if rich_text_body is not None:
+            MACRO_RICH_TEXT_BODY.render_to(self.write, {"body": rich_text_body})
+        MACRO_END.render_to(self.write, {})
+
+    def bobswift_macro(self, script_url: str, output_type: str = "INLINE"):
+        """
+        An html-bobswift macro showing the content of a URL.
+        """
+        # The macro takes a URL, rather than a script, when the value starts with #
+        self.macro("html-bobswift", {"script": "#" + script_url, "atlassian-macro-output-type": output_type})
+
+    def json_from_table_macro(self, url: str):
+        self.macro("json-from-table", {"isFirstTimeEnter": "true", "url": url})
+
+    def drawio_macro(self, diagram_name: str, revision: int = None, **parameters):
+        """
+        A draw.io macro showing a diagram attached to the page.
+
+        :param parameters: Further macro parameters, e.g. width, zoom or lbox
+        """
+        parameters = {"diagramName": diagram_name, **parameters}
+        if revision is not None:
+            parameters["revision"] = revision
+        self.macro("drawio", parameters)
@@ -0,0 +1,58 @@
+"""Unit tests for storage_hash."""
+
+from storage_hash import canonical_storage, same_storage, storage_hash
+
+def test_attribute_order_and_quoting_are_ignored():
+    """Test that attributes are compared by value, not by how they are written."""
+    assert same_storage('<ac:layout-section ac:type="single" a="1"/>', "<ac:layout-section a='1' ac:type='single'/>")
+
+def test_entity_spelling_is_ignored():
+    """Test that &nbsp;, &#160; and the character itself are the same."""
+    assert same_storage("<p>a&nbsp;b</p>", "<p>a&#160;b</p>")
+    assert same_storage("<p>a&nbsp;b</p>", "<p>a b</p>")
+
+def test_whitespace_between_blocks_is_ignored():
+    """Test that indentation between and inside block-level elements doesn't matter."""
+    compact = "<ac:layout><ac:layout-section><ac:layout-cell><h1>A</h1><p>B</p></ac:layout-cell></ac:layout-section></ac:layout>"
+    indented = """
+    <ac:layout>
+      <ac:layout-section>
+        <ac:layout-cell>
+          <h1> A </h1>
+          <p>B</p>
+        </ac:layout-cell>
+      </ac:layout-section>
+    </ac:layout>
+    """
+    assert same_storage(compact, indented)
+
+def test_runs_of_whitespace_are_collapsed():
+    """Test that a run of whitespace in text is the same as a single space."""
+    assert same_storage("<p>Hello  \n world</p>", "<p>Hello world</p>")
+
+def test_whitespace_at_inline_boundaries_is_kept():
+    """Test that a space next to an inline element is a real change."""
+    assert not same_storage("<p>Hello <b>world</b></p>", "<p>Hello<b>world</b></p>")
+    assert not same_storage("<p><b>Hello</b> world</p>", "<p><b>Hello</b>world</p>")
+    assert not same_storage("<p>Hello<b> world</b></p>", "<p>Hello<b>world</b></p>")
+
+def test_whitespace_in_pre_is_kept():
+    """Test that preformatted text is compared as it is."""
+    assert not same_storage("<pre>a  b</pre>", "<pre>a b</pre>")
+    assert not same_storage("<pre>\n  code</pre>", "<pre>code</pre>")
+
+def test_cdata_is_compared_as_it_is():
+    """Test that whitespace and entity-like text in CDATA sections are significant."""
+    macro = '<ac:structured-macro ac:name="code"><ac:plain-text-body><![CDATA[{}]]></ac:plain-text-body></ac:structured-macro>'
+    assert not same_storage(macro.format("x  = 1"), macro.format("x = 1"))
+    assert not same_storage(macro.format("a&nbsp;b"), macro.format("a&#160;b"))
+    assert "<![CDATA[a&nbsp;b]]>" in canonical_storage(macro.format("a&nbsp;b"))
+
+def test_text_changes_are_detected():
+    """Test that a different text gives a different hash."""
+    assert storage_hash("<p>Hello</p>") != storage_hash("<p>Hallo</p>")
+
+def test_malformed_storage_is_hashed_as_text():
+    """Test that storage format that isn't well-formed still gets a hash."""
+    assert storage_hash("<p>unclosed") == storage_hash("<p>unclosed")
+    assert storage_hash("<p>unclosed") != storage_hash("<p>unclosed ")